@@ -0,0 +1,751 @@
+#!/usr/bin/env python
+""" Benchmark of the toolkit commands on local fixtures.
+
+Generates synthetic remotes (bare git repos with many tags and
+branches, project-config, openstack-ansible, roles, requirements
+and releases), stub PyPI and Launchpad servers and a bug store,
+then times each console entry point of setup.py end to end, and
+stores the results as JSON to compare them between commits.
+"""
+# Stdlib
+from datetime import datetime
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+try:
+    from urllib import urlencode
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlencode, urlparse
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+# Extra packages
+import click
+import click_log
+from toolkit import CONTEXT_SETTINGS, format_table, list_remote_refs
+from toolkit import ref_prefixes
+from tests.test_cli import STARTUP_BUDGET, measure_startup
+
+# Workdir and other click defaults for this script
+WORK_DIR_OPT = ['-w', '--workdir']
+WORK_DIR_OPT_PARAMS = dict(default='/tmp/osa_benchmark',
+                           type=click.Path(file_okay=False, dir_okay=True,
+                                           writable=True, resolve_path=True),
+                           help='Work directory: fixtures and workspaces '
+                                '(erased)',
+                           show_default=True)
+OUTPUT_OPT = ['-o', '--output']
+OUTPUT_PARAMS = dict(default='benchmark.json',
+                     type=click.Path(dir_okay=False, writable=True),
+                     help='JSON results file', show_default=True)
+REPEAT_OPT = ['-r', '--repeat']
+REPEAT_PARAMS = dict(default=3, type=int,
+                     help='Runs of each command, the first one is cold',
+                     show_default=True)
+ONLY_OPT = ['--only']
+ONLY_PARAMS = dict(multiple=True,
+                   help='Only benchmark this entry point (repeatable)')
+DAEMON_OPT = ['--daemon/--no-daemon']
+DAEMON_PARAMS = dict(default=False,
+                     help='Runs the commands through the toolkit daemon')
+STARTUP_BUDGET_OPT = ['--startup-budget']
+STARTUP_BUDGET_PARAMS = dict(default=STARTUP_BUDGET, type=float,
+                             show_default=True,
+                             help='Maximum seconds osa-toolkit --help may '
+                                  'add to the interpreter start-up')
+
+# CODE STARTS HERE
+LOGGER = logging.getLogger(__name__)
+click_log.basic_config(LOGGER)
+
+# STATIC VARS
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERIES = ['newton', 'ocata', 'pike', 'queens']
+BRANCH = 'stable/pike'
+GIT_USER = 'OSA benchmark <benchmark@example.com>'
+GIT_ENV = dict(GIT_AUTHOR_NAME='OSA benchmark',
+               GIT_AUTHOR_EMAIL='benchmark@example.com',
+               GIT_COMMITTER_NAME='OSA benchmark',
+               GIT_COMMITTER_EMAIL='benchmark@example.com')
+OLD_SHA = '0' * 40
+# Entry points which are not commands to time
+SKIPPED_ENTRY_POINTS = ['osa-toolkit', 'osa-toolkit-daemon',
+                        'osa-toolkit-client']
+# Launchpad projects of the bugs, and their statuses
+BUG_PROJECTS = ['openstack-ansible'] + ['openstack-ansible-os_role{}'.format(
+    index) for index in range(10)]
+BUG_STATUSES = ['New', 'Confirmed', 'Triaged', 'Fix Released']
+# Bug tasks per page of the stub Launchpad, like Launchpad
+LAUNCHPAD_PAGE_SIZE = 75
+# What launchpadlib needs of the Launchpad WADL: the projects
+# and their searchTasks operation, returning pages of bug tasks
+LAUNCHPAD_WADL = """<?xml version="1.0"?>
+<wadl:application xmlns:wadl="http://research.sun.com/wadl/2006/10"
+                  xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <wadl:resources base="{root}">
+    <wadl:resource path="" type="#service-root"/>
+  </wadl:resources>
+  <wadl:resource_type id="service-root">
+    <wadl:method id="service-root-get" name="GET">
+      <wadl:response>
+        <wadl:representation href="#service-root-json"/>
+      </wadl:response>
+    </wadl:method>
+  </wadl:resource_type>
+  <wadl:representation id="service-root-json" mediaType="application/json">
+    <wadl:param style="plain" name="projects_collection_link"
+                path="$['projects_collection_link']">
+      <wadl:link resource_type="{root}#projects"/>
+    </wadl:param>
+  </wadl:representation>
+  <wadl:resource_type id="projects">
+    <wadl:method id="projects-get" name="GET">
+      <wadl:response>
+        <wadl:representation href="#project-page"/>
+      </wadl:response>
+    </wadl:method>
+  </wadl:resource_type>
+  <wadl:representation id="project-page" mediaType="application/json">
+    <wadl:param style="plain" name="entries" path="$['entries']"/>
+  </wadl:representation>
+  <wadl:resource_type id="project">
+    <wadl:method id="project-get" name="GET">
+      <wadl:response>
+        <wadl:representation href="#project-full"/>
+      </wadl:response>
+    </wadl:method>
+    <wadl:method id="project-searchTasks" name="GET">
+      <wadl:request>
+        <wadl:param style="query" name="ws.op" required="true"
+                    fixed="searchTasks"/>
+        <wadl:param style="query" name="status"/>
+        <wadl:param style="query" name="order_by"/>
+        <wadl:param style="query" name="modified_since"/>
+        <wadl:param style="query" name="omit_duplicates"/>
+      </wadl:request>
+      <wadl:response>
+        <wadl:representation href="#bug_task-page"/>
+      </wadl:response>
+    </wadl:method>
+  </wadl:resource_type>
+  <wadl:representation id="project-full" mediaType="application/json">
+    <wadl:param style="plain" name="self_link" path="$['self_link']"/>
+    <wadl:param style="plain" name="resource_type_link"
+                path="$['resource_type_link']"/>
+    <wadl:param style="plain" name="name" path="$['name']"/>
+  </wadl:representation>
+  <wadl:resource_type id="bug_task-page-resource">
+    <wadl:method id="bug_task-page-resource-get" name="GET">
+      <wadl:response>
+        <wadl:representation href="#bug_task-page"/>
+      </wadl:response>
+    </wadl:method>
+  </wadl:resource_type>
+  <wadl:representation id="bug_task-page" mediaType="application/json">
+    <wadl:param style="plain" name="total_size" path="$['total_size']"/>
+    <wadl:param style="plain" name="start" path="$['start']"/>
+    <wadl:param style="plain" name="next_collection_link"
+                path="$['next_collection_link']">
+      <wadl:link resource_type="{root}#bug_task-page-resource"/>
+    </wadl:param>
+    <wadl:param style="plain" name="entries" path="$['entries']"/>
+  </wadl:representation>
+  <wadl:resource_type id="bug_task">
+    <wadl:method id="bug_task-get" name="GET">
+      <wadl:response>
+        <wadl:representation href="#bug_task-full"/>
+      </wadl:response>
+    </wadl:method>
+  </wadl:resource_type>
+  <wadl:representation id="bug_task-full" mediaType="application/json">
+    <wadl:param style="plain" name="self_link" path="$['self_link']"/>
+    <wadl:param style="plain" name="resource_type_link"
+                path="$['resource_type_link']"/>
+    <wadl:param style="plain" name="bug_link" path="$['bug_link']"/>
+    <wadl:param style="plain" name="title" path="$['title']"/>
+    <wadl:param style="plain" name="web_link" path="$['web_link']"/>
+    <wadl:param style="plain" name="status" path="$['status']"/>
+    <wadl:param style="plain" name="importance" path="$['importance']"/>
+    <wadl:param style="plain" name="date_created" type="xsd:dateTime"
+                path="$['date_created']"/>
+    <wadl:param style="plain" name="date_left_new" type="xsd:dateTime"
+                path="$['date_left_new']"/>
+    <wadl:param style="plain" name="date_closed" type="xsd:dateTime"
+                path="$['date_closed']"/>
+    <wadl:param style="plain" name="date_last_updated" type="xsd:dateTime"
+                path="$['date_last_updated']"/>
+  </wadl:representation>
+</wadl:application>
+"""
+# Fixture sizes, overridable from the command line
+SIZES = dict(tags=2000, branches=50, services=40, repo_packages=30,
+             roles=80, projects=3000, packages=300, pins=60, bugs=5000)
+
+
+def entry_points(setup_path=None):
+    """ Returns the (name, module, function) of the
+    console scripts of setup.py
+    """
+    setup_path = setup_path or os.path.join(SCRIPT_DIR, 'setup.py')
+    with open(setup_path, 'r') as setup_fh:
+        content = setup_fh.read()
+    return re.findall(r'^\s*([\w-]+)=(\w+):(\w+)\s*$', content, re.M)
+
+
+def fast_import(path, files, refs, message='Benchmark fixture'):
+    """ Creates a bare repo at path with one commit of files
+    (a dict path: content) on master, and refs (a list of
+    full ref names) pointing to it.
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+    stream = ["commit refs/heads/master", "mark :1",
+              "committer {} 1500000000 +0000".format(GIT_USER),
+              "data {}".format(len(message)), message]
+    for file_path, content in sorted(files.items()):
+        content = content.encode('utf-8')
+        stream.extend(["M 644 inline {}".format(file_path),
+                       "data {}".format(len(content)),
+                       content.decode('utf-8')])
+    stream.append("")
+    for ref in refs:
+        stream.extend(["reset {}".format(ref), "from :1", ""])
+    process = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=path,
+                               stdin=subprocess.PIPE)
+    process.communicate("\n".join(stream).encode('utf-8') + b"\n")
+    if process.returncode:
+        raise SystemExit("Could not create {}".format(path))
+    subprocess.check_call(['git', 'pack-refs', '--all'], cwd=path)
+
+
+def many_refs(sizes):
+    """ Returns the tags and branches of a synthetic project """
+    refs = ['refs/heads/stable/{}'.format(series) for series in SERIES]
+    refs.extend('refs/heads/feature/topic-{}'.format(index)
+                for index in range(sizes['branches']))
+    refs.extend('refs/tags/{}.{}.{}'.format(12 + index // 250,
+                                            (index // 50) % 5, index % 50)
+                for index in range(sizes['tags']))
+    return refs
+
+
+class StubPypi(object):
+    """ Serves the JSON API of PyPI for a few packages,
+    from a thread of this process. Pages have an ETag, and
+    are not sent again to the clients which already have them.
+    """
+    def __init__(self, packages):
+        pages = dict(
+            (name, json.dumps({
+                'info': {'version': '{}.0.0'.format(major)},
+                'releases': dict(('{}.{}.{}'.format(major, minor, patch), [])
+                                 for minor in range(10)
+                                 for patch in range(10)),
+            }).encode('utf-8'))
+            for name, major in packages.items())
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.strip('/').split('/')[-2]
+                page = pages.get(name)
+                etag = '"{}-{}"'.format(name, packages.get(name))
+                if page and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200 if page else 404)
+                self.send_header('Content-Type', 'application/json')
+                if page:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(page or b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/pypi'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubLaunchpad(object):
+    """ Serves what launchpadlib needs of the Launchpad API (see
+    LAUNCHPAD_WADL) to search the bug tasks of a few projects,
+    from a thread of this process.
+    """
+    def __init__(self, tasks):
+        stub = self
+
+        def search(project, query):
+            """ Returns a page of the tasks of a project, like
+            searchTasks, newest first.
+            """
+            params = dict((key, values[0]) for key, values in query.items())
+            states = json.loads(params.get('status', 'null'))
+            since = json.loads(params.get('modified_since', 'null'))
+            start = int(params.get('ws.start', 0))
+            size = int(params.get('ws.size', LAUNCHPAD_PAGE_SIZE))
+            found = [task for task in tasks if task['project'] == project and
+                     (states is None or task['status'] in states) and
+                     (since is None or task['updated'] >= since)]
+            found.sort(key=lambda task: task['date_created'], reverse=True)
+            page = {'total_size': len(found), 'start': start,
+                    'entries': [stub.entry(task)
+                                for task in found[start:start + size]]}
+            if start + size < len(found):
+                params.update({'ws.start': start + size, 'ws.size': size})
+                page['next_collection_link'] = '{}{}?{}'.format(
+                    stub.root, project, urlencode(sorted(params.items())))
+            return page
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                project = url.path[len('/devel/'):]
+                content_type = 'application/json'
+                if url.path == '/devel/' and \
+                        'wadl' in self.headers.get('Accept', ''):
+                    content_type = 'application/vnd.sun.wadl+xml'
+                    body = stub.wadl
+                elif url.path == '/devel/':
+                    body = json.dumps({
+                        'projects_collection_link': stub.root + 'projects',
+                        'resource_type_link': stub.root + '#service-root',
+                    }).encode('utf-8')
+                elif project in BUG_PROJECTS and not query:
+                    body = json.dumps({
+                        'self_link': stub.root + project,
+                        'resource_type_link': stub.root + '#project',
+                        'name': project,
+                    }).encode('utf-8')
+                elif project in BUG_PROJECTS and \
+                        query.get('ws.op') == ['searchTasks']:
+                    body = json.dumps(search(project, query)).encode('utf-8')
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.root = self.url + 'devel/'
+        self.wadl = LAUNCHPAD_WADL.format(root=self.root).encode('utf-8')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def entry(self, task):
+        """ Returns the JSON representation of a bug task """
+        bug_link = '{}bugs/{}'.format(self.root, task['bug_id'])
+        entry = {'self_link': '{}{}/+bug/{}'.format(self.root, task['project'],
+                                                   task['bug_id']),
+                 'resource_type_link': self.root + '#bug_task',
+                 'bug_link': bug_link,
+                 'date_last_updated': task['updated'] + '+00:00'}
+        for key in ['title', 'web_link', 'status', 'importance',
+                    'date_created', 'date_left_new', 'date_closed']:
+            entry[key] = task[key]
+            if key.startswith('date_') and task[key]:
+                entry[key] += '+00:00'
+        return entry
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def generate_fixtures(workdir, sizes):
+    """ Creates the remotes, the workspaces, the bug store.
+    Returns the packages served by the stub PyPI, and the
+    bug tasks served by the stub Launchpad.
+    """
+    rand = random.Random(0)
+    remotes = os.path.join(workdir, 'remotes', 'openstack')
+    refs = many_refs(sizes)
+
+    LOGGER.info("Creating %s service remotes" % sizes['services'])
+    services = ['service{}'.format(index)
+                for index in range(sizes['services'])]
+    for service in services:
+        fast_import(os.path.join(remotes, service),
+                    {'README.rst': service}, refs)
+
+    LOGGER.info("Creating %s role remotes" % sizes['roles'])
+    roles = ['os_role{}'.format(index) for index in range(sizes['roles'])]
+    for role in roles:
+        fast_import(
+            os.path.join(remotes, 'openstack-ansible-' + role),
+            {'meta/main.yml': ("galaxy_info:\n  platforms:\n"
+                               "    - name: Ubuntu\n      versions:\n"
+                               "        - xenial\n"),
+             'meta/openstack-ansible.yml': ("maturity_info:\n"
+                                            "  status: Complete\n"
+                                            "  created_during: Mitaka\n"),
+             'releasenotes/notes/{}-0123456789abcdef.yaml'.format(role):
+                 "---\nfeatures:\n  - {} feature\n".format(role)},
+            refs)
+
+    LOGGER.info("Creating project-config")
+    projects = ['openstack/openstack-ansible-' + role for role in roles]
+    projects.extend('openstack/project{}'.format(index) for index in
+                    range(max(0, sizes['projects'] - len(projects))))
+    rand.shuffle(projects)
+    fast_import(
+        os.path.join(workdir, 'remotes', 'openstack-infra', 'project-config'),
+        {'gerrit/projects.yaml': "".join(
+            "- project: {}\n  description: {}\n  use-storyboard: true\n"
+            "  options:\n    - translate\n".format(project,
+                                                    project.split('/')[-1])
+            for project in projects)},
+        ['refs/heads/master'])
+
+    LOGGER.info("Creating requirements")
+    packages = dict(('package{}'.format(index), rand.randint(1, 9))
+                    for index in range(sizes['packages']))
+    fast_import(
+        os.path.join(remotes, 'requirements'),
+        {'upper-constraints.txt': "".join(
+            "{}==={}.0.0\n".format(name, major)
+            for name, major in sorted(packages.items()))},
+        refs)
+    requirements_sha = subprocess.check_output(
+        ['git', 'rev-parse', 'master'],
+        cwd=os.path.join(remotes, 'requirements')).decode('utf-8').strip()
+
+    LOGGER.info("Creating openstack-ansible")
+    repo_packages = {}
+    for index in range(sizes['repo_packages']):
+        lines = []
+        for service in services[index::sizes['repo_packages']] or [
+                services[index % len(services)]]:
+            lines.extend([
+                "## {}".format(service),
+                "{}_git_repo: file://{}/{}".format(service, remotes, service),
+                '{}_git_install_branch: {} # HEAD of "{}" as of 01.01.2017'
+                .format(service, OLD_SHA, BRANCH),
+                "{}_git_project_group: {}_all".format(service, service),
+                ""])
+        repo_packages['playbooks/defaults/repo_packages/services{}.yml'
+                      .format(index)] = "\n".join(lines)
+    repo_packages['playbooks/defaults/repo_packages/'
+                  'openstack_services.yml'] = (
+        "requirements_git_repo: file://{}/requirements\n"
+        'requirements_git_install_branch: {} # HEAD of "master" as of '
+        "01.01.2017\n".format(remotes, requirements_sha))
+    files = dict(repo_packages)
+    files['ansible-role-requirements.yml'] = "".join(
+        "- name: {}\n  scm: git\n  src: file://{}/openstack-ansible-{}\n"
+        "  version: master\n".format(role, remotes, role) for role in roles)
+    files['group_vars/all/all.yml'] = "openstack_release: 16.0.3\n"
+    files['global-requirement-pins.txt'] = "".join(
+        "{}<{}\n".format(name, major)
+        for name, major in sorted(packages.items())[:sizes['pins']])
+    files['doc/source/contributor/role-maturity-matrix.html'] = "\n"
+    files['releasenotes/notes/.placeholder'] = ""
+    fast_import(os.path.join(remotes, 'openstack-ansible'), files,
+                ['refs/heads/{}'.format(BRANCH)])
+
+    LOGGER.info("Creating releases")
+    fast_import(
+        os.path.join(remotes, 'releases.git'),
+        {'deliverables/{}/openstack-ansible.yaml'.format(series): (
+            "---\nlaunchpad: openstack-ansible\nreleases:\n"
+            "  - version: {}.0.0\n    projects:\n"
+            "      - repo: openstack/openstack-ansible\n"
+            "        hash: {}\n".format(major, OLD_SHA))
+         for series, major in zip(SERIES, range(14, 18))},
+        ['refs/heads/master'])
+
+    LOGGER.info("Creating the bug store")
+    from bugtriage import DB_FILE, SCHEMA
+    bugs_dir = os.path.join(workdir, 'bugtriage')
+    os.makedirs(bugs_dir)
+    conn = sqlite3.connect(os.path.join(bugs_dir, DB_FILE))
+    conn.executescript(SCHEMA)
+    words = ['nova', 'neutron', 'galera', 'rabbitmq', 'lxc', 'container',
+             'upgrade', 'fails', 'timeout', 'keystone', 'haproxy', 'ssl',
+             'venv', 'pip', 'install', 'playbook', 'handler', 'restart',
+             'ceph', 'cinder', 'horizon', 'memcached', 'python', 'role']
+    tasks = []
+    for bug_id in range(sizes['bugs']):
+        project = rand.choice(BUG_PROJECTS)
+        created = datetime.fromtimestamp(1400000000 + bug_id * 20000)
+        status = rand.choice(BUG_STATUSES)
+        task = {
+            'project': project, 'bug_id': bug_id,
+            'title': 'Bug #{} in {}: "{}"'.format(bug_id, project, " ".join(
+                rand.sample(words, 6))),
+            'web_link': 'https://bugs.launchpad.net/{}/+bug/{}'.format(
+                project, bug_id),
+            'status': status,
+            'importance': rand.choice(['High', 'Medium', 'Low']),
+            'date_created': created.strftime('%Y-%m-%dT%H:%M:%S'),
+            'date_left_new': (None if status == 'New' else
+                              created.strftime('%Y-%m-%dT23:59:59')),
+            'date_closed': None}
+        task['updated'] = task['date_left_new'] or task['date_created']
+        tasks.append(task)
+        conn.execute(
+            "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            tuple(task[key] for key in [
+                'project', 'bug_id', 'title', 'web_link', 'status',
+                'importance', 'date_created', 'date_left_new',
+                'date_closed']))
+        conn.execute("INSERT INTO history VALUES (?, ?, ?, ?)",
+                     (project, bug_id, 'New', task['date_created']))
+        if status != 'New':
+            conn.execute("INSERT INTO history VALUES (?, ?, ?, ?)",
+                         (project, bug_id, status, task['date_left_new']))
+    conn.commit()
+    conn.close()
+    # The bug triage page syncs its own store from the stub Launchpad
+    os.makedirs(os.path.join(workdir, 'bugsync'))
+    return packages, tasks
+
+
+def reset_workspace(workdir):
+    """ Brings back the openstack-ansible workspace to its
+    remote state, so that each run has the same work to do.
+    """
+    oa_folder = os.path.join(workdir, 'workspace', 'openstack-ansible')
+    remote = os.path.join(workdir, 'remotes', 'openstack',
+                          'openstack-ansible')
+    if not os.path.lexists(oa_folder):
+        subprocess.check_call(['git', 'clone', '-q', '-b', BRANCH,
+                               'file://' + remote, oa_folder])
+    subprocess.check_call(['git', 'reset', '-q', '--hard',
+                           'origin/' + BRANCH], cwd=oa_folder)
+    subprocess.check_call(['git', 'clean', '-q', '-fdx'], cwd=oa_folder)
+
+
+def benchmarks(workdir, pypi_url, launchpad_url):
+    """ Returns the arguments (and the answers to the prompts)
+    of each benchmarked entry point
+    """
+    workspace = os.path.join(workdir, 'workspace')
+    bugs = os.path.join(workdir, 'bugtriage')
+    projects = [arg for project in BUG_PROJECTS for arg in ['-p', project]]
+    arr_args = ['-w', workspace, '--jobs', '16']
+    if not which('rsync'):
+        LOGGER.warning("rsync not found, release notes are not copied")
+        arr_args.append('--no-release-notes')
+    return {
+        'check-global-requirements': (
+            ['-w', workspace, '--pypi-url', pypi_url, '--jobs', '16'], 'y\n'),
+        'bump-upstream-sources': (['-w', workspace, '--jobs', '16'], ''),
+        'update-role-files': (['-w', workspace], ''),
+        'bump-ansible-role-requirements': (arr_args, 'y\n'),
+        'bump-oa-release-number': (['-w', workspace], ''),
+        'update-os-release-file': (
+            ['-w', workspace, '--branch', 'pike', '--version', '16.0.4'],
+            'y\ny\n'),
+        'update-role-maturity-matrix': (['-w', workspace], ''),
+        'generate-bug-triage-page': (
+            ['-w', os.path.join(workdir, 'bugsync'),
+             '--service-root', launchpad_url,
+             '-s', 'New', '-s', 'Confirmed'] + projects, ''),
+        'bug-trends': (['-w', bugs, '--format', 'json'], ''),
+    }
+
+
+def benchmark_ref_queries(url, repeat):
+    """ Compares a full listing of a remote with the listing
+    of the refs needed to resolve a branch and a tag.
+    Returns the refs count, size and best time of both.
+    """
+    prefixes = ref_prefixes(BRANCH) + ref_prefixes('12.0.3')
+    results = {}
+    for name, query_prefixes in [('full', None), ('filtered', prefixes)]:
+        durations = []
+        for _ in range(max(1, repeat)):
+            start = time.time()
+            refs = list_remote_refs(url, prefixes=query_prefixes)
+            durations.append(time.time() - start)
+        results[name] = {'refs': len(refs),
+                         'bytes': sum(len(ref) + 1 for ref in refs),
+                         'seconds': round(min(durations), 4)}
+    return results
+
+
+def start_daemon(workdir, env):
+    """ Starts the toolkit daemon on a socket of the workdir.
+    Returns its process, once it listens.
+    """
+    socket_path = os.path.join(workdir, 'daemon.sock')
+    env['OSA_TOOLKIT_SOCKET'] = socket_path
+    with open(os.path.join(workdir, 'daemon.log'), 'w') as log_fh:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, 'daemon.py'),
+             '-s', socket_path], env=env, stdout=log_fh, stderr=log_fh)
+    for _ in range(600):
+        if os.path.exists(socket_path) or process.poll() is not None:
+            break
+        time.sleep(0.1)
+    if not os.path.exists(socket_path):
+        process.kill()
+        raise SystemExit("The daemon did not start, see daemon.log")
+    return process
+
+
+def run_entry_point(command, args, answers, env):
+    """ Runs an entry point command in a new process.
+    Returns its duration, return code and the end of its stderr.
+    """
+    start = time.time()
+    process = subprocess.Popen(command + args, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env)
+    _, stderr = process.communicate(answers.encode('utf-8'))
+    duration = time.time() - start
+    return duration, process.returncode, stderr.decode('utf-8')[-2000:]
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click_log.simple_verbosity_option(LOGGER)
+@click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
+@click.option(*OUTPUT_OPT, **OUTPUT_PARAMS)
+@click.option(*REPEAT_OPT, **REPEAT_PARAMS)
+@click.option(*ONLY_OPT, **ONLY_PARAMS)
+@click.option(*DAEMON_OPT, **DAEMON_PARAMS)
+@click.option(*STARTUP_BUDGET_OPT, **STARTUP_BUDGET_PARAMS)
+@click.option('--sizes', default='',
+              help='Fixture sizes, like tags=5000,roles=120 (defaults: {})'
+                   .format(",".join("{}={}".format(key, value)
+                                    for key, value in sorted(SIZES.items()))))
+def benchmark(**kwargs):
+    """ Time each entry point of setup.py on generated fixtures
+    """
+    sizes = dict(SIZES)
+    for size in filter(None, kwargs['sizes'].split(',')):
+        key, value = size.split('=')
+        if key not in sizes:
+            raise SystemExit("Unknown fixture size {}".format(key))
+        sizes[key] = int(value)
+
+    workdir = kwargs['workdir']
+    if os.path.lexists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(os.path.join(workdir, 'workspace'))
+    start = time.time()
+    packages, tasks = generate_fixtures(workdir, sizes)
+    LOGGER.info("Fixtures generated in %.1fs" % (time.time() - start))
+
+    env = dict(os.environ, **GIT_ENV)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [SCRIPT_DIR] + list(filter(None, [env.get('PYTHONPATH')])))
+    env['OSA_TOOLKIT_OPENSTACK_REPOS'] = 'file://{}/remotes/openstack'.format(
+        workdir)
+    env['OSA_TOOLKIT_MIRROR_DIR'] = os.path.join(workdir, 'mirrors')
+
+    results = []
+    daemon = None
+    with StubPypi(packages) as pypi, StubLaunchpad(tasks) as launchpad:
+        env['OSA_TOOLKIT_PYPI_URL'] = pypi.url
+        if kwargs['daemon']:
+            daemon = start_daemon(workdir, env)
+        arguments = benchmarks(workdir, pypi.url, launchpad.url)
+        for name, module, function in entry_points():
+            if kwargs['only'] and name not in kwargs['only']:
+                continue
+            if name in SKIPPED_ENTRY_POINTS:
+                continue
+            if name not in arguments:
+                LOGGER.warning("No benchmark for %s" % name)
+                continue
+            if daemon:
+                command = [sys.executable,
+                           os.path.join(SCRIPT_DIR, 'client.py'), name]
+            else:
+                command = [sys.executable, '-c', 'from {} import {}; {}()'
+                           .format(module, function, function)]
+            args, answers = arguments[name]
+            result = {'entry_point': name, 'args': args, 'runs': [],
+                      'returncodes': []}
+            for _ in range(max(1, kwargs['repeat'])):
+                reset_workspace(workdir)
+                duration, returncode, stderr = run_entry_point(
+                    command, args, answers, env)
+                result['runs'].append(round(duration, 3))
+                result['returncodes'].append(returncode)
+                if returncode:
+                    LOGGER.error("%s failed:\n%s" % (name, stderr))
+            LOGGER.info("%s: %s" % (name, result['runs']))
+            results.append(result)
+        if daemon:
+            daemon.terminate()
+            daemon.wait()
+
+    ref_queries = benchmark_ref_queries(
+        'file://{}/remotes/openstack/service0'.format(workdir),
+        kwargs['repeat'])
+    LOGGER.info("Remote refs queries: %s" % ref_queries)
+    startup = measure_startup(kwargs['repeat'], env)
+    LOGGER.info("osa-toolkit --help start-up: %s" % startup)
+
+    commit = subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR).decode('utf-8').strip()
+    report = {
+        'commit': commit,
+        'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'sizes': sizes,
+        'daemon': kwargs['daemon'],
+        'results': results,
+        'ref_queries': ref_queries,
+        'startup': startup,
+    }
+    with open(kwargs['output'], 'w') as output_fh:
+        json.dump(report, output_fh, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+    click.echo(format_table(
+        ['Entry point', 'Cold (s)', 'Warm (s)', 'Status'],
+        [[result['entry_point'], '{:.2f}'.format(result['runs'][0]),
+          '{:.2f}'.format(min(result['runs'][1:])) if len(result['runs']) > 1
+          else '-',
+          'ok' if not any(result['returncodes']) else 'failed']
+         for result in results]))
+    if startup['imported']:
+        raise SystemExit("osa-toolkit --help imported {}".format(
+            ", ".join(startup['imported'])))
+    if startup['seconds'] > kwargs['startup_budget']:
+        raise SystemExit("osa-toolkit --help took {}s more than python, "
+                         "over the {}s budget".format(
+                             startup['seconds'], kwargs['startup_budget']))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 """ Tools for bug triage"""
 # Stdlib
+from collections import OrderedDict
+import csv
+from datetime import datetime, timedelta
+import io
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import sqlite3
+import sys
+import re
+import threading
+import zlib
 # Extra packages
 import click
 import click_log
-from launchpadlib.launchpad import Launchpad
-from toolkit import CONTEXT_SETTINGS
+import numpy
+from toolkit import CONTEXT_SETTINGS, atomic_write, trace_span, traced
 
 # Workdir and other click defaults for this script
 WORK_DIR_OPT = ['-w', '--workdir']
@@ -17,6 +28,36 @@ WORK_DIR_OPT_PARAMS = dict(default='/tmp/bugtriage',
                                            resolve_path=True),
                            help='Work directory: Temporary workspace folder',
                            show_default=True)
+SERVICE_ROOT_OPT = ['--service-root']
+SERVICE_ROOT_PARAMS = dict(default='production',
+                           help='Launchpad service root (name or URL)',
+                           show_default=True)
+SYNC_OPT = ['--sync/--offline']
+SYNC_PARAMS = dict(default=True,
+                   help='fetches the bugs changed since the last sync, '
+                        'or only uses the local store')
+PROJECT_OPT = ['-p', '--project']
+PROJECT_PARAMS = dict(multiple=True, default=['openstack-ansible'],
+                      help='Launchpad project to triage (repeatable)',
+                      show_default=True)
+STATUS_OPT = ['-s', '--status']
+STATUS_PARAMS = dict(multiple=True, default=['New'],
+                     help='Bug status to triage (repeatable)',
+                     show_default=True)
+JOBS_OPT = ['-j', '--jobs']
+JOBS_PARAMS = dict(default=8, type=int,
+                   help='Number of projects fetched in parallel',
+                   show_default=True)
+DUPLICATES_OPT = ['--duplicates']
+DUPLICATES_PARAMS = dict(default=3, type=int,
+                         help='Number of similar bugs listed next to each '
+                              'bug (0 to disable)',
+                         show_default=True)
+SIMILARITY_OPT = ['--min-similarity']
+SIMILARITY_PARAMS = dict(default=0.3, type=float,
+                         help='Minimum (estimated jaccard) similarity '
+                              'of the listed similar bugs',
+                         show_default=True)
 
 # CODE STARTS HERE
 LOGGER = logging.getLogger(__name__)
@@ -24,12 +65,427 @@ click_log.basic_config(LOGGER)
 
 # STATIC VARS
 STATES = ['New']
+PROJECTS = ['openstack-ansible']
+JOBS = 8
 ORDERBY = '-datecreated'
+# All the task statuses, to find out which bugs left STATES
+ALL_STATES = ['New', 'Incomplete', 'Opinion', 'Invalid', "Won't Fix",
+              'Expired', 'Confirmed', 'Triaged', 'In Progress',
+              'Fix Committed', 'Fix Released']
+# Status stored for the bugs marked as duplicates of another bug
+DUPLICATE = 'Duplicate'
+# Local store of the bug tasks, in the workdir
+DB_FILE = 'bugs.sqlite'
+# MinHash signatures of the bug titles, in the workdir
+INDEX_FILE = 'cache/bug_signatures.npz'
+MINHASH_SIZE = 128
+# Largest prime below 2**32, hashes stay uint32
+MINHASH_PRIME = 4294967291
+# Pairs of bugs compared at once, to bound the memory used
+SCORE_PAIRS = 65536
+# Sums the bytes of an uint64 into its highest byte
+BYTES_SUM = 0x0101010101010101
+# Launchpad and local clocks can differ, sync a bit more than needed
+SYNC_OVERLAP = timedelta(minutes=10)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    project TEXT NOT NULL,
+    bug_id INTEGER NOT NULL,
+    title TEXT,
+    web_link TEXT,
+    status TEXT,
+    importance TEXT,
+    date_created TEXT,
+    date_left_new TEXT,
+    date_closed TEXT,
+    PRIMARY KEY (project, bug_id)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, date_created);
+CREATE TABLE IF NOT EXISTS sync (
+    query TEXT PRIMARY KEY,
+    watermark TEXT
+);
+CREATE TABLE IF NOT EXISTS history (
+    project TEXT NOT NULL,
+    bug_id INTEGER NOT NULL,
+    status TEXT,
+    observed_at TEXT
+);
+"""
+# Trends reports, and their columns
+REPORTS = OrderedDict([
+    ('weekly', ['week', 'created', 'left_new', 'closed',
+                'median_days_to_triage']),
+    ('transitions', ['from_status', 'to_status', 'count']),
+    ('projects', ['project', 'status', 'importance', 'count']),
+])
+FORMAT_OPT = ['--format']
+FORMAT_PARAMS = dict(default='csv', type=click.Choice(['csv', 'json']),
+                     help='Output format', show_default=True)
+REPORT_OPT = ['--report']
+REPORT_PARAMS = dict(default='weekly', type=click.Choice(list(REPORTS)),
+                     help='Report to output as csv (json has them all)',
+                     show_default=True)
+
+
+def open_store(path):
+    """ Opens (and creates if needed) the local bug store """
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def isodate(date):
+    """ Returns a launchpad date as an ISO 8601 string, or None """
+    if date is None:
+        return None
+    return date.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def sync_query(project_name, states):
+    """ Returns the key of the sync watermark of a project and states """
+    return "{}:{}".format(project_name, ",".join(sorted(states)))
+
+
+def get_watermark(conn, project_name, states):
+    """ Returns the date of the previous sync of a project and states,
+    or None if they were never synced.
+    """
+    row = conn.execute("SELECT watermark FROM sync WHERE query = ?",
+                       (sync_query(project_name, states),)).fetchone()
+    return row[0] if row else None
+
+
+def fetch_tasks(launchpad, project_name, states, watermark=None):
+    """ Fetches the bug tasks of a project in states from launchpad,
+    or all the tasks modified since watermark, whatever their status,
+    to know which tasks left states. The tasks of the bugs marked as
+    duplicates since watermark get the DUPLICATE status.
+    Returns the start date of the fetch and the task rows.
+    """
+    started = datetime.utcnow()
+    with trace_span('network', 'launchpad project', project=project_name):
+        project = launchpad.projects[project_name]
+    originals = None
+    if watermark:
+        LOGGER.info("Fetching %s bugs modified since %s" % (project_name,
+                                                           watermark))
+        tasks = project.searchTasks(status=ALL_STATES, order_by=ORDERBY,
+                                    modified_since=watermark,
+                                    omit_duplicates=False)
+        # Duplicates are omitted by default: the bugs which are
+        # only found with them are the duplicates
+        originals = project.searchTasks(status=ALL_STATES, order_by=ORDERBY,
+                                        modified_since=watermark)
+    else:
+        LOGGER.info("Fetching all %s bugs" % project_name)
+        tasks = project.searchTasks(status=states, order_by=ORDERBY)
+    # Only keep what the page needs, without fetching the bug itself
+    with trace_span('network', 'launchpad tasks', project=project_name):
+        if originals is not None:
+            originals = set(task.bug_link for task in originals)
+        rows = [(project_name, int(task.bug_link.rsplit('/', 1)[-1]),
+                 task.title, task.web_link,
+                 task.status if originals is None or
+                 task.bug_link in originals else DUPLICATE,
+                 task.importance, isodate(task.date_created),
+                 isodate(task.date_left_new), isodate(task.date_closed))
+                for task in tasks]
+    return started, rows
+
+
+def store_tasks(conn, project_name, states, started, rows):
+    """ Stores the fetched task rows of a project into the local
+    store, with their status changes, and moves the watermark.
+    """
+    with trace_span('sqlite', 'store tasks', project=project_name):
+        for row in rows:
+            # Keep the status history, for the trends
+            previous = conn.execute(
+                "SELECT status FROM tasks WHERE project = ? AND bug_id = ?",
+                row[:2]).fetchone()
+            if previous is None or previous[0] != row[4]:
+                conn.execute("INSERT INTO history VALUES (?, ?, ?, ?)",
+                             (project_name, row[1], row[4], isodate(started)))
+            conn.execute("INSERT OR REPLACE INTO tasks "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        conn.execute("INSERT OR REPLACE INTO sync VALUES (?, ?)",
+                     (sync_query(project_name, states),
+                      isodate(started - SYNC_OVERLAP)))
+        conn.commit()
+
+
+def sync_tasks(conn, launchpad, project_name, states=None):
+    """ Stores the bug tasks of a project in states into the
+    local store. The first sync fetches all of them, the next
+    ones only fetch the tasks modified since the previous sync.
+    Returns the number of fetched tasks.
+    """
+    states = states or STATES
+    started, rows = fetch_tasks(launchpad, project_name, states,
+                                get_watermark(conn, project_name, states))
+    store_tasks(conn, project_name, states, started, rows)
+    return len(rows)
+
+
+def sync_projects(conn, login, project_names, states=None, jobs=JOBS):
+    """ Syncs the bug tasks of multiple projects, fetching them
+    in parallel (one launchpad session per thread, as launchpadlib
+    is not thread safe). The tasks are stored from this thread,
+    as each project arrives.
+    Returns the projects which failed to sync.
+    """
+    states = states or STATES
+    local = threading.local()
+    watermarks = dict((name, get_watermark(conn, name, states))
+                      for name in project_names)
+
+    def fetch_project(project_name):
+        try:
+            if not hasattr(local, 'launchpad'):
+                with trace_span('network', 'launchpad login'):
+                    local.launchpad = login()
+            return (project_name,
+                    fetch_tasks(local.launchpad, project_name, states,
+                                watermarks[project_name]), None)
+        except Exception as exc:
+            return project_name, None, exc
+
+    failed = []
+    pool = ThreadPool(max(1, min(jobs, len(project_names))))
+    try:
+        for project_name, result, error in pool.imap_unordered(
+                fetch_project, project_names):
+            if error is not None:
+                LOGGER.error("Could not sync %s: %s" % (project_name, error))
+                failed.append(project_name)
+                continue
+            store_tasks(conn, project_name, states, *result)
+            LOGGER.info("Synced %s bugs of %s" % (len(result[1]),
+                                                  project_name))
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+
+def bug_name(title):
+    """ Returns the name of a bug from its task title """
+    # bug title is like:
+    # '
+    # Bug #1724025 in openstack-ansible:
+    # invalid regular expression..."
+    # '
+    return "".join(title.split(":")[1:])
+
+
+def title_shingles(title):
+    """ Returns the hashes of the words and pairs of words of a title """
+    words = re.findall(r'[a-z0-9_]+', bug_name(title).lower())
+    shingles = set(words)
+    shingles.update(" ".join(pair) for pair in zip(words, words[1:]))
+    return numpy.array([zlib.crc32(shingle.encode('utf-8')) & 0xffffffff
+                        for shingle in shingles], dtype=numpy.uint64)
+
+
+class BugIndex(object):
+    """ MinHash signatures of the bug titles of the local store,
+    to find similar bugs. Only the bugs which are not in the
+    index (or which changed title) are hashed, the index is
+    kept in the workdir between runs.
+    """
+    def __init__(self, path):
+        self.path = path
+        rand = numpy.random.RandomState(0)
+        self.coeffs = rand.randint(1, MINHASH_PRIME, size=MINHASH_SIZE,
+                                   dtype=numpy.int64).astype(numpy.uint64)
+        self.offsets = rand.randint(0, MINHASH_PRIME, size=MINHASH_SIZE,
+                                    dtype=numpy.int64).astype(numpy.uint64)
+        self.bug_ids = numpy.zeros(0, dtype=numpy.int64)
+        self.checksums = numpy.zeros(0, dtype=numpy.uint32)
+        self.signatures = numpy.zeros((0, MINHASH_SIZE), dtype=numpy.uint32)
+        self.rows = {}
+        self.changed = False
+        if os.path.exists(path):
+            with numpy.load(path) as data:
+                self.bug_ids = data['bug_ids']
+                self.checksums = data['checksums']
+                self.signatures = data['signatures']
+            self.rows = dict((bug_id, row) for row, bug_id
+                             in enumerate(self.bug_ids.tolist()))
+
+    def signature(self, hashes):
+        """ Returns the MinHash signature of shingle hashes.
+        Hashes, coefficients and offsets are below 2**32, so
+        a * x + b stays below 2**64: the uint64 products do not
+        wrap before the modulo.
+        """
+        permuted = ((hashes[:, None] * self.coeffs + self.offsets) %
+                    MINHASH_PRIME)
+        return permuted.min(axis=0).astype(numpy.uint32)
+
+    def update(self, conn):
+        """ Adds the new (or renamed) bugs of the local store,
+        and removes the bugs marked as duplicates.
+        """
+        titles = conn.execute(
+            "SELECT bug_id, MIN(title) FROM tasks WHERE status != ? "
+            "GROUP BY bug_id", (DUPLICATE,)).fetchall()
+        bug_ids = set(bug_id for bug_id, _ in titles)
+        keep = numpy.array([bug_id in bug_ids
+                            for bug_id in self.bug_ids.tolist()], dtype=bool)
+        if not keep.all():
+            self.bug_ids = self.bug_ids[keep]
+            self.checksums = self.checksums[keep]
+            self.signatures = self.signatures[keep]
+            self.rows = dict((bug_id, row) for row, bug_id
+                             in enumerate(self.bug_ids.tolist()))
+            self.changed = True
+        new_ids, new_checksums, new_signatures = [], [], []
+        for bug_id, title in titles:
+            checksum = zlib.crc32(bug_name(title).encode('utf-8')) & 0xffffffff
+            row = self.rows.get(bug_id)
+            if row is not None and self.checksums[row] == checksum:
+                continue
+            hashes = title_shingles(title)
+            if not len(hashes):
+                continue
+            if row is not None:
+                self.checksums[row] = checksum
+                self.signatures[row] = self.signature(hashes)
+            else:
+                new_ids.append(bug_id)
+                new_checksums.append(checksum)
+                new_signatures.append(self.signature(hashes))
+            self.changed = True
+        if new_ids:
+            LOGGER.info("Indexing %s new bugs" % len(new_ids))
+            for row, bug_id in enumerate(new_ids, len(self.bug_ids)):
+                self.rows[bug_id] = row
+            self.bug_ids = numpy.concatenate(
+                [self.bug_ids, numpy.array(new_ids, dtype=numpy.int64)])
+            self.checksums = numpy.concatenate(
+                [self.checksums, numpy.array(new_checksums,
+                                             dtype=numpy.uint32)])
+            self.signatures = numpy.vstack([self.signatures] + new_signatures)
+
+    def save(self):
+        """ Saves the index, if it changed """
+        if not self.changed:
+            return
+        content = io.BytesIO()
+        numpy.savez(content, bug_ids=self.bug_ids, checksums=self.checksums,
+                    signatures=self.signatures)
+        atomic_write(self.path, content.getvalue())
+        self.changed = False
+
+    def similar_many(self, bug_ids, top=3, min_similarity=0.0):
+        """ Returns {bug_id: [(bug_id, similarity)]} with the top
+        most similar bugs of each of bug_ids, most similar first.
+        The bugs are compared to the whole index by chunks, on the
+        low byte of their minhashes, then the best candidates (which
+        only rarely differ because of the byte collisions) are scored
+        on the full minhashes.
+        """
+        rows = numpy.array([self.rows[bug_id] for bug_id in bug_ids
+                            if bug_id in self.rows], dtype=numpy.int64)
+        size = len(self.bug_ids)
+        if top <= 0 or not len(rows) or size < 2:
+            return {}
+        low_bytes = self.signatures.astype(numpy.uint8)
+        candidates = min(size - 1, 4 * top)
+        chunk_size = max(1, SCORE_PAIRS // size)
+        similar = {}
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            # Count the equal minhashes 8 at a time: each byte of the
+            # uint64 view of the comparison is 0 or 1
+            words = (low_bytes[None, :, :] ==
+                     low_bytes[chunk][:, None, :]).view(numpy.uint64)
+            matches = ((words.sum(axis=2) * numpy.uint64(BYTES_SUM)) >>
+                       numpy.uint64(56)).astype(numpy.int64)
+            matches[numpy.arange(len(chunk)), chunk] = -1
+            best = numpy.argpartition(-matches, candidates - 1,
+                                      axis=1)[:, :candidates]
+            # Estimated jaccard similarity: ratio of identical minhashes
+            scores = (self.signatures[best] ==
+                      self.signatures[chunk][:, None, :]).sum(axis=2) / (
+                          float(MINHASH_SIZE))
+            for row, row_best, row_scores in zip(chunk, best, scores):
+                order = numpy.lexsort((row_best, -row_scores))[:top]
+                similar[int(self.bug_ids[row])] = [
+                    (int(self.bug_ids[row_best[index]]),
+                     float(row_scores[index])) for index in order
+                    if row_best[index] != row and
+                    row_scores[index] >= min_similarity]
+        return similar
+
+    def similar(self, bug_id, top=3, min_similarity=0.0):
+        """ Returns the (bug_id, similarity) of the top most similar
+        bugs of bug_id, most similar first (see similar_many).
+        """
+        return self.similar_many([bug_id], top, min_similarity).get(
+            bug_id, [])
+
+
+def iter_page_lines(conn, states=None, project_names=None, index=None,
+                    top=3, min_similarity=0.0):
+    """ Yields the lines of the bug triage page, for the
+    tasks of projects in states found in the local store,
+    newest first. A bug affecting multiple projects is only
+    listed once. With an index, the top most similar bugs are
+    listed under each bug.
+    """
+    states = states or STATES
+    project_names = project_names or PROJECTS
+    cursor = conn.execute(
+        "SELECT bug_id, title, web_link FROM tasks "
+        "WHERE status IN ({}) AND project IN ({}) "
+        "ORDER BY date_created DESC, bug_id, project".format(
+            ",".join("?" * len(states)), ",".join("?" * len(project_names))),
+        list(states) + list(project_names))
+    seen = set()
+    bugs = []
+    for bug_id, title, web_link in cursor:
+        if bug_id not in seen:
+            seen.add(bug_id)
+            bugs.append((bug_id, title, web_link))
+    similar, similar_tasks = {}, {}
+    if index is not None:
+        with trace_span('phase', 'score similar bugs', bugs=len(bugs)):
+            similar = index.similar_many([bug[0] for bug in bugs], top,
+                                         min_similarity)
+        similar_ids = set(similar_id for matches in similar.values()
+                          for similar_id, _ in matches)
+        if similar_ids:
+            # bug ids are integers from the index, safe to inline,
+            # and too many for the SQLite variables limit
+            for bug_id, title, web_link in conn.execute(
+                    "SELECT bug_id, title, web_link FROM tasks "
+                    "WHERE bug_id IN ({}) ORDER BY project".format(
+                        ",".join(str(int(similar_id))
+                                 for similar_id in sorted(similar_ids)))):
+                similar_tasks.setdefault(bug_id, (title, web_link))
+    for bug_id, title, web_link in bugs:
+        yield "#link {link}\n\t{name}".format(link=web_link,
+                                               name=bug_name(title))
+        for similar_id, score in similar.get(bug_id, []):
+            similar_title, similar_link = similar_tasks[similar_id]
+            yield "\t\tsimilar ({score:.2f}): {link}\n\t\t\t{name}".format(
+                score=score, link=similar_link, name=bug_name(similar_title))
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click_log.simple_verbosity_option(LOGGER)
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
+@click.option(*SERVICE_ROOT_OPT, **SERVICE_ROOT_PARAMS)
+@click.option(*SYNC_OPT, **SYNC_PARAMS)
+@click.option(*PROJECT_OPT, **PROJECT_PARAMS)
+@click.option(*STATUS_OPT, **STATUS_PARAMS)
+@click.option(*JOBS_OPT, **JOBS_PARAMS)
+@click.option(*DUPLICATES_OPT, **DUPLICATES_PARAMS)
+@click.option(*SIMILARITY_OPT, **SIMILARITY_PARAMS)
+@traced
 def generate_page(**kwargs):
     """ Generate a bug triage page to help the triaging process
     """
@@ -39,16 +495,172 @@ def generate_page(**kwargs):
         LOGGER.info("Creating cache folder")
         os.mkdir(cache_folder)
 
-    launchpad = Launchpad.login_anonymously('osa_toolkit',
-                                            'production', cache_folder,
-                                            version='devel')
-    oa = launchpad.projects['openstack-ansible']
-    for bug in oa.searchTasks(status=STATES, order_by=ORDERBY):
-        # bug title is like:
-        # '
-        # Bug #1724025 in openstack-ansible:
-        # invalid regular expression..."
-        # '
-        bug_name = "".join(bug.title.split(":")[1:])
-        print("#link {link}\n\t{name}".format(link=bug.web_link,
-                                              name=bug_name))
+    conn = open_store(os.path.join(kwargs['workdir'], DB_FILE))
+    failed = []
+    if kwargs['sync']:
+        # launchpadlib is slow to import, and only needed to sync
+        from launchpadlib.launchpad import Launchpad
+
+        def login():
+            return Launchpad.login_anonymously('osa_toolkit',
+                                               kwargs['service_root'],
+                                               cache_folder,
+                                               version='devel')
+        failed = sync_projects(conn, login, kwargs['project'],
+                               kwargs['status'], kwargs['jobs'])
+    index = None
+    if kwargs['duplicates'] > 0:
+        with trace_span('phase', 'index bugs'):
+            index = BugIndex(os.path.join(kwargs['workdir'], INDEX_FILE))
+            index.update(conn)
+            index.save()
+    for line in iter_page_lines(conn, kwargs['status'], kwargs['project'],
+                                index, kwargs['duplicates'],
+                                kwargs['min_similarity']):
+        print(line)
+    conn.close()
+    if failed:
+        raise SystemExit("Could not sync: {}".format(", ".join(failed)))
+
+
+def load_columns(conn, query):
+    """ Returns the result of a query as a list of numpy arrays,
+    one per column. Date columns (named date_* or *_at) are
+    datetime64 arrays.
+    """
+    cursor = conn.execute(query)
+    names = [description[0] for description in cursor.description]
+    rows = cursor.fetchall()
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    arrays = []
+    for name, column in zip(names, columns):
+        if name.startswith('date_') or name.endswith('_at'):
+            arrays.append(numpy.array(column, dtype='datetime64[s]'))
+        else:
+            arrays.append(numpy.array(column, dtype=object))
+    return arrays
+
+
+def week_start(dates):
+    """ Returns the monday of the week of each datetime64 """
+    # datetime64 weeks start on thursdays (like 1970-01-01)
+    monday = numpy.timedelta64(4, 'D')
+    return ((dates - monday).astype('datetime64[W]') +
+            monday).astype('datetime64[D]')
+
+
+def weekly_trends(conn):
+    """ Returns, for each week, the number of bugs created,
+    leaving New and closed, and the median number of days
+    to triage the bugs created that week.
+    """
+    created, left_new, closed = load_columns(
+        conn, "SELECT date_created, date_left_new, date_closed FROM tasks")
+    counts = []
+    for dates in (created, left_new, closed):
+        dates = dates[~numpy.isnat(dates)]
+        counts.append(numpy.unique(week_start(dates), return_counts=True))
+    weeks = numpy.union1d(numpy.union1d(counts[0][0], counts[1][0]),
+                          counts[2][0])
+    table = numpy.zeros((len(weeks), 3), dtype=int)
+    for index, (count_weeks, count) in enumerate(counts):
+        table[numpy.searchsorted(weeks, count_weeks), index] = count
+
+    # Time to triage, grouped by week of creation
+    triaged = ~numpy.isnat(created) & ~numpy.isnat(left_new)
+    days = ((left_new[triaged] - created[triaged]) /
+            numpy.timedelta64(1, 'D'))
+    triaged_weeks = week_start(created[triaged])
+    order = numpy.argsort(triaged_weeks, kind='mergesort')
+    triaged_weeks, days = triaged_weeks[order], days[order]
+    bounds = numpy.searchsorted(triaged_weeks, weeks, side='left')
+    ends = numpy.searchsorted(triaged_weeks, weeks, side='right')
+
+    rows = []
+    for index, week in enumerate(weeks):
+        week_days = days[bounds[index]:ends[index]]
+        rows.append({
+            'week': str(week),
+            'created': int(table[index, 0]),
+            'left_new': int(table[index, 1]),
+            'closed': int(table[index, 2]),
+            'median_days_to_triage': (round(float(numpy.median(week_days)), 1)
+                                      if len(week_days) else None),
+        })
+    return rows
+
+
+def status_transitions(conn):
+    """ Returns how many times tasks went from a status
+    to another, according to the history of the syncs.
+    """
+    projects, bug_ids, statuses, observed = load_columns(
+        conn, "SELECT project, bug_id, status, observed_at FROM history")
+    if not len(statuses):
+        return []
+    _, tasks = numpy.unique(numpy.char.add(
+        projects.astype(str), bug_ids.astype(str)), return_inverse=True)
+    names, codes = numpy.unique(statuses.astype(str), return_inverse=True)
+    order = numpy.lexsort((observed, tasks))
+    tasks, codes = tasks[order], codes[order]
+    changed = (tasks[1:] == tasks[:-1]) & (codes[1:] != codes[:-1])
+    pairs, counts = numpy.unique(
+        codes[:-1][changed] * len(names) + codes[1:][changed],
+        return_counts=True)
+    return [{'from_status': names[pair // len(names)],
+             'to_status': names[pair % len(names)],
+             'count': int(count)}
+            for pair, count in zip(pairs, counts)]
+
+
+def project_breakdown(conn):
+    """ Returns the number of tasks per project (role),
+    status and importance.
+    """
+    projects, statuses, importances = load_columns(
+        conn, "SELECT project, status, importance FROM tasks")
+    if not len(projects):
+        return []
+    keys = numpy.array(list(zip(projects, statuses, importances)),
+                       dtype=[('project', object), ('status', object),
+                              ('importance', object)]).astype(
+                                  [('project', 'U128'), ('status', 'U32'),
+                                   ('importance', 'U32')])
+    groups, counts = numpy.unique(keys, return_counts=True)
+    return [{'project': group['project'], 'status': group['status'],
+             'importance': group['importance'], 'count': int(count)}
+            for group, count in zip(groups, counts)]
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click_log.simple_verbosity_option(LOGGER)
+@click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
+@click.option(*FORMAT_OPT, **FORMAT_PARAMS)
+@click.option(*REPORT_OPT, **REPORT_PARAMS)
+@traced
+def bug_trends(**kwargs):
+    """ Output bug trends computed from the local bug store
+    (synced by generate-bug-triage-page)
+    """
+    conn = open_store(os.path.join(kwargs['workdir'], DB_FILE))
+    reports = {
+        'weekly': weekly_trends,
+        'transitions': status_transitions,
+        'projects': project_breakdown,
+    }
+    if kwargs['format'] == 'json':
+        results = {}
+        for name in REPORTS:
+            with trace_span('report', name):
+                results[name] = reports[name](conn)
+        click.echo(json.dumps(results, indent=2, sort_keys=True,
+                              separators=(',', ': ')))
+    else:
+        writer = csv.DictWriter(sys.stdout,
+                                fieldnames=REPORTS[kwargs['report']])
+        writer.writeheader()
+        with trace_span('report', kwargs['report']):
+            rows = reports[kwargs['report']](conn)
+        for row in rows:
+            writer.writerow(row)
+    conn.close()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" osa-toolkit, a single entry point for the toolkit commands,
+importing only the module of the command which is run
+"""
+# Stdlib
+import importlib
+# Extra packages
+import click
+
+# Same as toolkit's, which is too slow to import here
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+# STATIC VARS
+# Commands of osa-toolkit, named after their console script:
+# name -> (module, function, short help)
+COMMANDS = {
+    'check-global-requirements': (
+        'release', 'check_global_requirement_pins',
+        "Check pypi for new versions of our pins"),
+    'bump-upstream-sources': (
+        'release', 'bump_upstream_sources',
+        "Bump OpenStack projects SHA in OA repo"),
+    'update-role-files': (
+        'release', 'update_role_files',
+        "Bump OpenStack Projects files into roles"),
+    'bump-ansible-role-requirements': (
+        'release', 'bump_arr',
+        "Freeze the roles of the role requirements"),
+    'bump-oa-release-number': (
+        'release', 'bump_oa_release_number',
+        "Update OpenStack Ansible version number"),
+    'update-os-release-file': (
+        'release', 'update_os_release_file',
+        "Update in tree a release file"),
+    'update-role-maturity-matrix': (
+        'maturity', 'update_role_maturity_matrix',
+        "Update in tree the maturity.html file"),
+    'generate-bug-triage-page': (
+        'bugtriage', 'generate_page',
+        "Generate a bug triage page"),
+    'bug-trends': (
+        'bugtriage', 'bug_trends',
+        "Output bug trends from the local bug store"),
+}
+
+
+def load_command(name):
+    """ Returns the click command of a command name,
+    importing its module
+    """
+    module, function, _ = COMMANDS[name]
+    return getattr(importlib.import_module(module), function)
+
+
+class LazyGroup(click.MultiCommand):
+    """ Group of the COMMANDS, which only imports a module
+    when one of its commands is run
+    """
+    def list_commands(self, ctx):
+        return sorted(COMMANDS)
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+        return load_command(name)
+
+    def format_commands(self, ctx, formatter):
+        """ Lists the commands without importing them """
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, COMMANDS[name][2])
+                                for name in self.list_commands(ctx)])
+
+
+@click.command(cls=LazyGroup, context_settings=CONTEXT_SETTINGS)
+def main():
+    """ OpenStack-Ansible toolkit. The commands are also
+    installed as scripts of the same names.
+    """
+
+
+if __name__ == '__main__':
+    main()
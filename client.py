@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+""" Thin client of the toolkit daemon (see daemon.py).
+Only uses the standard library, to start fast.
+"""
+# Stdlib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+# STATIC VARS
+SOCKET_PATH = os.environ.get(
+    'OSA_TOOLKIT_SOCKET',
+    os.path.expanduser('~/.cache/osa_toolkit/daemon.sock'))
+# Frames received from the daemon: channel, payload length, payload
+FRAME_HEADER = struct.Struct('!cI')
+
+
+def read_exactly(conn, size):
+    """ Reads size bytes from a socket, or raises EOFError """
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Connection closed by the daemon")
+        data += chunk
+    return data
+
+
+def forward_stdin(conn):
+    """ Sends the standard input to the daemon, for the prompts """
+    try:
+        while True:
+            data = os.read(sys.stdin.fileno(), 4096)
+            if not data:
+                break
+            conn.sendall(data)
+        conn.shutdown(socket.SHUT_WR)
+    except (OSError, socket.error, ValueError):
+        pass
+
+
+def run(argv, socket_path=SOCKET_PATH):
+    """ Runs a command in the daemon, copying its output.
+    Returns its exit code.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except socket.error:
+        sys.stderr.write("The toolkit daemon is not running on {}, "
+                         "start it with osa-toolkit-daemon\n".format(
+                             socket_path))
+        return 2
+    request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+    conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+    stdin_thread = threading.Thread(target=forward_stdin, args=(conn,))
+    stdin_thread.daemon = True
+    stdin_thread.start()
+    outputs = {b'o': sys.stdout, b'e': sys.stderr}
+    try:
+        while True:
+            channel, size = FRAME_HEADER.unpack(
+                read_exactly(conn, FRAME_HEADER.size))
+            payload = read_exactly(conn, size)
+            if channel == b'x':
+                return struct.unpack('!i', payload)[0]
+            output = getattr(outputs[channel], 'buffer', outputs[channel])
+            output.write(payload)
+            output.flush()
+    except EOFError as error:
+        sys.stderr.write("{}\n".format(error))
+        return 1
+    finally:
+        conn.close()
+
+
+def main():
+    """ osa-toolkit-client COMMAND [OPTIONS] """
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        sys.stderr.write("Usage: osa-toolkit-client COMMAND [OPTIONS]\n"
+                         "Runs a toolkit command in the toolkit daemon\n")
+        sys.exit(2)
+    sys.exit(run(sys.argv[1:]))
+
+
+if __name__ == '__main__':
+    main()
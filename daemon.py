@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+""" Long-lived toolkit daemon, serving the toolkit commands
+over a Unix socket (see client.py), with warm imports,
+repos and caches
+"""
+# Stdlib
+import io
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import traceback
+# Extra packages
+import click
+import click_log
+from cli import COMMANDS, load_command
+import toolkit
+from toolkit import CONTEXT_SETTINGS
+
+# Socket and other click defaults for this script
+SOCKET_OPT = ['-s', '--socket']
+SOCKET_PARAMS = dict(default=os.environ.get(
+    'OSA_TOOLKIT_SOCKET',
+    os.path.expanduser('~/.cache/osa_toolkit/daemon.sock')),
+    type=click.Path(dir_okay=False, resolve_path=True),
+    help='Unix socket to listen on', show_default=True)
+
+# CODE STARTS HERE
+LOGGER = logging.getLogger(__name__)
+click_log.basic_config(LOGGER)
+
+# STATIC VARS
+# Frames sent to the client: channel, payload length, payload
+FRAME_HEADER = struct.Struct('!cI')
+STDOUT = b'o'
+STDERR = b'e'
+EXIT = b'x'
+
+
+class ChannelWriter(object):
+    """ File-like object sending what is written to a channel
+    of the client connection, from any thread.
+    """
+    encoding = 'utf-8'
+    errors = 'replace'
+
+    def __init__(self, conn, channel, lock):
+        self.conn = conn
+        self.channel = channel
+        self.lock = lock
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode(self.encoding, self.errors)
+        if not data:
+            return
+        with self.lock:
+            self.conn.sendall(FRAME_HEADER.pack(self.channel, len(data)) +
+                              data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def run_command(request):
+    """ Runs a command for a client, in its directory and
+    environment, with its output and input redirected to the
+    connection. Returns the exit code.
+    """
+    argv = request['argv']
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write("Unknown command. Available commands: {}\n".format(
+            ", ".join(sorted(COMMANDS))))
+        return 2
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    try:
+        os.chdir(request.get('cwd') or cwd)
+        if request.get('env') is not None:
+            os.environ.clear()
+            for key, value in request['env'].items():
+                if sys.version_info[0] == 2:
+                    # Python 2 environment holds bytes
+                    key, value = key.encode('utf-8'), value.encode('utf-8')
+                os.environ[key] = value
+        load_command(argv[0]).main(args=argv[1:], prog_name=argv[0])
+    except SystemExit as exit_exc:
+        if exit_exc.code is None or isinstance(exit_exc.code, int):
+            return exit_exc.code or 0
+        sys.stderr.write("{}\n".format(exit_exc.code))
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+    return 0
+
+
+def handle(conn):
+    """ Serves one client connection """
+    lock = threading.Lock()
+    reader = conn.makefile('rb')
+    try:
+        request = json.loads(reader.readline().decode('utf-8'))
+        LOGGER.info("Running %s" % " ".join(request['argv']))
+    except Exception as error:
+        LOGGER.error("Invalid request: %s" % error)
+        ChannelWriter(conn, STDERR, lock).write(
+            "Invalid request: {!r}\n".format(error))
+        request, code = None, 2
+    if request is not None:
+        saved = sys.stdin, sys.stdout, sys.stderr
+        # The rest of the connection is the input of the command
+        if isinstance(reader, io.BufferedIOBase):
+            sys.stdin = io.TextIOWrapper(reader, encoding='utf-8')
+        else:
+            sys.stdin = reader
+        sys.stdout = ChannelWriter(conn, STDOUT, lock)
+        sys.stderr = ChannelWriter(conn, STDERR, lock)
+        try:
+            code = run_command(request)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved
+    conn.sendall(FRAME_HEADER.pack(EXIT, 4) + struct.pack('!i', code))
+    LOGGER.info("Exited with %s" % code)
+
+
+def listen(path):
+    """ Returns a Unix socket listening on path, removing
+    the socket of a daemon which is not running anymore.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.remove(path)
+        else:
+            raise SystemExit("A daemon is already listening on {}".format(
+                path))
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(8)
+    return server
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click_log.simple_verbosity_option(LOGGER)
+@click.option(*SOCKET_OPT, **SOCKET_PARAMS)
+def serve(**kwargs):
+    """ Serve the toolkit commands over a Unix socket,
+    to run them with osa-toolkit-client without paying
+    the imports and cold caches each time.
+    Commands are run one at a time.
+    """
+    # Pay the imports once
+    for name in sorted(COMMANDS):
+        load_command(name)
+    toolkit.WARM_OBJECTS = {}
+    server = listen(kwargs['socket'])
+    LOGGER.info("Listening on %s" % kwargs['socket'])
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                handle(conn)
+            except Exception as error:
+                LOGGER.error("Client error: %s" % error)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(kwargs['socket'])
+
+
+if __name__ == '__main__':
+    serve()
@@ -4,17 +4,22 @@
 # Stdlib
 from datetime import datetime
 import codecs
+import hashlib
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
 # Extra Packages
 import click
 import click_log
-from git import Repo
-from git import exc as gitExceptions
-from jinja2 import Template
-from toolkit import CONTEXT_SETTINGS, OPENSTACK_REPOS, PROJECT_CONFIG_REPO
-from toolkit import load_yaml, tracking_branch_name
+from jinja2 import Environment, FileSystemLoader
+from toolkit import CONTEXT_SETTINGS, MIRROR_DIR, OPENSTACK_REPOS
+from toolkit import PROJECT_CONFIG_REPO
+from toolkit import ObjectReader, RoleRequirements
+from toolkit import atomic_write, fetch_repo, iter_yaml_list_values
+from toolkit import sync_repo, trace_span, traced, tracking_branch_name
+from toolkit import warm
 
 # Workdir and other click defaults for this script
 WORK_DIR_OPT = ['-w', '--workdir']
@@ -27,6 +32,25 @@ WORK_DIR_OPT_PARAMS = dict(default='/tmp/maturity',
 COMMIT_OPT = ['--commit/--no-commit']
 COMMIT_PARAMS = dict(default=False,
                      help='commits automatically the generated changes')
+MIRROR_OPT = ['--mirror/--no-mirror']
+MIRROR_PARAMS = dict(default=True,
+                     help='reuses the objects of shared bare mirrors '
+                          'instead of downloading them for each clone')
+MIRROR_DIR_OPT = ['--mirror-dir']
+MIRROR_DIR_PARAMS = dict(default=MIRROR_DIR,
+                         type=click.Path(file_okay=False, dir_okay=True,
+                                         resolve_path=True),
+                         help='Folder of the shared bare mirrors',
+                         show_default=True)
+JOBS_OPT = ['-j', '--jobs']
+JOBS_PARAMS = dict(default=8, type=int,
+                   help='Number of role repositories synced concurrently',
+                   show_default=True)
+FORMAT_OPT = ['-f', '--format']
+FORMAT_PARAMS = dict(multiple=True, default=['html'],
+                     type=click.Choice(['html', 'rst', 'json']),
+                     help='Format of the maturity matrix to write '
+                          '(repeatable)', show_default=True)
 
 # Deprecated roles data:
 RETIRED_ROLES = [
@@ -44,19 +68,176 @@ RETIRED_ROLES = [
     },
 ]
 
+# Maturity matrix files, relative to openstack-ansible, and their templates
+MATRIX_FILES = {
+    'html': ("doc/source/contributor/role-maturity-matrix.html",
+             'maturity_table.html.j2'),
+    'rst': ("doc/source/contributor/role-maturity-matrix.rst",
+            'maturity_table.rst.j2'),
+    'json': ("doc/source/contributor/role-maturity-matrix.json", None),
+}
+
+# OSA projects found in project-config, for a given project-config sha
+PROJECTS_CACHE_FILE = 'cache/osa_projects.json'
+# Roles SHAs and rows of the last generated maturity matrix
+STATE_FILE = 'cache/maturity_state.json'
+
 # CODE STARTS HERE
 LOGGER = logging.getLogger(__name__)
 click_log.basic_config(LOGGER)
+# Templates are compiled once per process, and kept by the daemon
+TEMPLATES = Environment(
+    loader=FileSystemLoader(os.path.dirname(os.path.abspath(__file__))),
+    auto_reload=False, keep_trailing_newline=True)
+
+
+def file_sha1(path):
+    """ Returns the sha1 hex digest of a file content,
+    or None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as sha_fh:
+        return hashlib.sha1(sha_fh.read()).hexdigest()
+
+
+def find_osa_projects(pjct_cfg_repo, cache_path):
+    """ Returns the list of (fullname, shortname) of the OSA
+    roles projects listed in project-config.
+    The projects are extracted while parsing gerrit/projects.yaml,
+    and memoized in cache_path for the project-config HEAD sha.
+    """
+    sha = pjct_cfg_repo.head.commit.hexsha
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as cache_fh:
+            try:
+                cache = json.load(cache_fh)
+            except ValueError:
+                cache = {}
+        if cache.get('sha') == sha:
+            return [tuple(project) for project in cache['projects']]
+
+    projects = []
+    pjcts_path = "{}/gerrit/projects.yaml".format(pjct_cfg_repo.working_dir)
+    with open(pjcts_path, 'r') as pjcts_fh:
+        with trace_span('yaml', 'projects.yaml'):
+            for project in iter_yaml_list_values(pjcts_fh, 'project'):
+                if project.startswith('openstack/openstack-ansible-'):
+                    project_fullname = project.split('/')[-1]
+                    project_shortname = project_fullname.split(
+                        'openstack-ansible-')[-1]
+                elif project == 'openstack/ansible-hardening':
+                    project_fullname = 'ansible-hardening'
+                    project_shortname = 'ansible-hardening'
+                else:
+                    continue
+                projects.append((project_fullname, project_shortname))
+    atomic_write(cache_path, json.dumps({'sha': sha, 'projects': projects}))
+    return projects
+
+
+def partition_roles(roles):
+    """ Splits the roles into the active and the retired ones """
+    partitions = {'active_roles': [], 'retired_roles': []}
+    for role in roles or []:
+        if role['maturity_level'] == 'retired':
+            partitions['retired_roles'].append(role)
+        else:
+            partitions['active_roles'].append(role)
+    return partitions
 
 
 def generate_maturity_matrix_html(roles=None):
     """ From Information about roles, generate a matrix, return html."""
-    script_dir = os.path.dirname(__file__)
-    template_path = os.path.join(script_dir, 'maturity_table.html.j2')
-    with codecs.open(template_path, encoding='utf-8') as mt_tmpl_fh:
-        mt_tmpl = mt_tmpl_fh.read()
-    template = Template(mt_tmpl)
-    return template.render(roles=roles)
+    template = TEMPLATES.get_template(MATRIX_FILES['html'][1])
+    with trace_span('render', 'maturity matrix'):
+        return template.render(**partition_roles(roles))
+
+
+def write_maturity_matrix(fmt, partitions, path):
+    """ Writes the maturity matrix of partitioned roles
+    to path, in the given format.
+    """
+    template_name = MATRIX_FILES[fmt][1]
+    with trace_span('render', 'maturity matrix', format=fmt, path=path):
+        with codecs.open(path, mode='w', encoding='utf-8') as matrix_fh:
+            if template_name is None:
+                json.dump(partitions, matrix_fh, indent=2, sort_keys=True,
+                          separators=(',', ': '))
+                matrix_fh.write('\n')
+            else:
+                template = TEMPLATES.get_template(template_name)
+                template.stream(**partitions).dump(matrix_fh)
+
+
+def read_role_metadata(reader, sha, name):
+    """ Returns the maturity matrix row of a role, from its
+    metadata at a given sha (read through an ObjectReader),
+    or None if the project is not a role.
+    """
+    role = dict()
+    role['name'] = name
+    std_meta = reader.read_yaml(sha, 'meta/main.yml')
+    if std_meta is None:
+        # If no meta/main (like ops), don't count as
+        # a role to update.
+        return None
+    # Only take what you need from standard metadata
+    # Example of standard metadata:
+    # galaxy_info:
+    #   author: rcbops
+    #   description: Installation and setup of neutron
+    #   company: Rackspace
+    #   license: Apache2
+    #   min_ansible_version: 2.2
+    #   platforms:
+    #     - name: Ubuntu
+    #       versions:
+    #         - xenial
+    #     - name: EL
+    #       versions:
+    #         - 7
+    #     - name: opensuse
+    #       versions:
+    #         - 42.1
+    #         - 42.2
+    #         - 42.3
+    #   categories:
+    #     - cloud
+    #     - python
+    #     - neutron
+    #     - development
+    #     - openstack
+    role['opensuse'] = False
+    role['ubuntu'] = False
+    role['centos'] = False
+    for platform in std_meta['galaxy_info']['platforms']:
+        if platform['name'].lower() == 'opensuse':
+            role['opensuse'] = True
+            role['opensuse_versions'] = platform['versions']
+        elif platform['name'].lower() == 'ubuntu':
+            role['ubuntu'] = True
+            role['ubuntu_versions'] = platform['versions']
+        elif (platform['name'].lower() == 'centos' or
+              platform['name'].upper() == 'EL'):
+            role['centos'] = True
+            role['centos_versions'] = platform['versions']
+    # Example of maturity info metadata:
+    # maturity_info:
+    #     status: complete
+    #     created_during: mitaka
+    osa_meta = reader.read_yaml(sha, 'meta/openstack-ansible.yml')
+    if osa_meta is None:
+        role['maturity_level'] = 'unknown'
+        role['created_during'] = 'unknown'
+        role['retired_during'] = 'unknown'
+    else:
+        role['maturity_level'] = osa_meta['maturity_info']['status'].lower()
+        role['created_during'] = osa_meta['maturity_info'][
+            'created_during'].lower()
+        role['retired_during'] = osa_meta['maturity_info'].get(
+            'retired_during', 'unknown').lower()
+    return role
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
@@ -64,27 +245,28 @@ def generate_maturity_matrix_html(roles=None):
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
 @click.option(*COMMIT_OPT, **COMMIT_PARAMS)
 @click.option('--branch', help='OSA branch to update if OSA folder absent')
+@click.option(*MIRROR_OPT, **MIRROR_PARAMS)
+@click.option(*MIRROR_DIR_OPT, **MIRROR_DIR_PARAMS)
+@click.option(*JOBS_OPT, **JOBS_PARAMS)
+@click.option('--full/--incremental', default=False,
+              help='re-reads all the roles instead of the changed ones')
+@click.option(*FORMAT_OPT, **FORMAT_PARAMS)
+@traced
 def update_role_maturity_matrix(**kwargs):
     """ Update in tree the maturity.html file
     by fetching each of the role's metadata
     inside your workdir
     """
     LOGGER.info("Workspace folder is %s" % kwargs['workdir'])
+    mirror_dir = kwargs['mirror'] and kwargs['mirror_dir']
     matrix = []
     # Find projects through Project Config
     LOGGER.info("Cloning OpenStack Project Config")
     pjct_cfg_path = kwargs['workdir'] + '/project-config'
     if os.path.lexists(pjct_cfg_path):
         LOGGER.info("Project config already exists, updating.")
-        # If exists, ensure up to date
-        pjct_cfg_repo = Repo(pjct_cfg_path)
-        pjct_cfg_repo_o = pjct_cfg_repo.remotes.origin
-        pjct_cfg_repo_o.pull()
-    else:
-        _ = Repo.clone_from(
-            url=PROJECT_CONFIG_REPO,
-            to_path=pjct_cfg_path,
-            branch="master")
+    pjct_cfg_repo = sync_repo(PROJECT_CONFIG_REPO, pjct_cfg_path, "master",
+                              mirror_dir=mirror_dir)
 
     # Ensure OpenStack-Ansible can receive the new maturity matrix
     oa_folder = kwargs['workdir'] + '/openstack-ansible'
@@ -92,159 +274,134 @@ def update_role_maturity_matrix(**kwargs):
     if os.path.lexists(oa_folder) and kwargs['branch']:
         LOGGER.info("openstack-ansible already exists, checking out branch.")
         # If exists, ensure up to date
-        oa_repo = Repo(oa_folder)
-        oa_repo_o = oa_repo.remotes.origin
-        oa_repo_o.pull()
         branch = kwargs['branch']
+        oa_repo = sync_repo("{}/openstack-ansible".format(OPENSTACK_REPOS),
+                            oa_folder, branch, mirror_dir=mirror_dir)
         oa_repo.git.checkout(branch)
     elif os.path.lexists(oa_folder) and not kwargs['branch']:
         LOGGER.info("openstack-ansible already exists, re-using branch.")
         # If exists, ensure up to date
-        oa_repo = Repo(oa_folder)
-        oa_repo_o = oa_repo.remotes.origin
-        oa_repo_o.pull()
         branch = tracking_branch_name(oa_folder)
+        oa_repo = sync_repo("{}/openstack-ansible".format(OPENSTACK_REPOS),
+                            oa_folder, branch, mirror_dir=mirror_dir)
     elif not os.path.lexists(oa_folder) and kwargs['branch']:
         LOGGER.info("Cloning OpenStack-Ansible with given branch")
         branch = kwargs['branch']
-        oa_repo = Repo.clone_from(
-            url="{}/openstack-ansible".format(OPENSTACK_REPOS),
-            to_path=oa_folder,
-            branch=branch)
+        oa_repo = fetch_repo("{}/openstack-ansible".format(OPENSTACK_REPOS),
+                             oa_folder, branch, mirror_dir=mirror_dir)
     else:
         LOGGER.error("Not enough data")
         raise SystemExit("You do not have openstack-ansible checked out "
                          "and no branch was given")
 
     # Load ARR for matrix "integrated" info
-    arr, _, _ = load_yaml('{}/ansible-role-requirements.yml'.format(oa_folder))
+    arr = RoleRequirements.read(
+        '{}/ansible-role-requirements.yml'.format(oa_folder))
 
     # For each project, get the metadata
-    pjcts, _, _ = load_yaml("{}/gerrit/projects.yaml".format(pjct_cfg_path))
-    for project in pjcts:
-        role = dict()
-        if project['project'].startswith('openstack/openstack-ansible-'):
-            project_fullname = project['project'].split('/')[-1]
-            project_shortname = project_fullname.split(
-                'openstack-ansible-')[-1]
-        elif project['project'] == 'openstack/ansible-hardening':
-            project_fullname = 'ansible-hardening'
-            project_shortname = 'ansible-hardening'
-        else:
+    projects = find_osa_projects(
+        pjct_cfg_repo, "{}/{}".format(kwargs['workdir'], PROJECTS_CACHE_FILE))
+
+    def sync_project(project):
+        """ Clones the project, or ensures it is up to date.
+        Metadata is read from the git objects, so nothing
+        needs to be checked out.
+        """
+        project_fullname, _ = project
+        return sync_repo("{}/{}".format(OPENSTACK_REPOS, project_fullname),
+                         "{}/{}".format(kwargs['workdir'], project_fullname),
+                         "master", mirror_dir=mirror_dir, checkout=False)
+
+    # Network bound, so sync all the projects at once,
+    # then read their metadata in order.
+    LOGGER.info("Syncing %s projects" % len(projects))
+    pool = ThreadPool(max(1, kwargs['jobs']))
+    try:
+        with trace_span('phase', 'sync projects'):
+            project_repos = pool.map(sync_project, projects)
+    finally:
+        pool.close()
+        pool.join()
+
+    # All the metadata files are read by the same git process
+    reader_path = kwargs['workdir'] + '/cache/objects.git'
+    reader = warm(('object_reader', reader_path,
+                   tuple(repo.git_dir for repo in project_repos)),
+                  lambda: ObjectReader(reader_path, project_repos))
+    # Only re-read the roles which changed since the last run
+    state_path = "{}/{}".format(kwargs['workdir'], STATE_FILE)
+    state = {}
+    if os.path.exists(state_path) and not kwargs['full']:
+        with open(state_path, 'r') as state_fh:
+            try:
+                state = json.load(state_fh)
+            except ValueError:
+                state = {}
+    previous_roles = state.get('roles', {})
+    roles_state = {}
+    for project, project_repo in zip(projects, project_repos):
+        _, project_shortname = project
+
+        # read the metadata of the branch matching the osa branch
+        project_sha = reader.resolve(project_repo, branch)
+        if project_sha is None:
+            LOGGER.info(
+                ("Project {projectname} has no branch {branchname} "
+                 "and will be ignored from the maturity "
+                 "table".format(
+                     projectname=project_shortname,
+                     branchname=branch))
+            )
             continue
-        LOGGER.info("Loading metadata for %s" % project_shortname)
-
-        project_path = "{}/{}".format(kwargs['workdir'], project_fullname)
-        if os.path.lexists(project_path):
-            # If exists, ensure up to date
-            project_repo = Repo(project_path)
-            origin = project_repo.remotes.origin
-            origin.pull()
+
+        previous_role = previous_roles.get(project_shortname)
+        if previous_role and previous_role['sha'] == project_sha:
+            LOGGER.debug("%s unchanged" % project_shortname)
+            row = previous_role['row']
         else:
-            # cloning the project!
-            project_repo = Repo.clone_from(
-                url="{}/{}".format(OPENSTACK_REPOS, project_fullname),
-                to_path=project_path,
-                branch="master")
-
-        # checkout to a branch matching the osa branch, or checkout master
-        # if none is matching
-        try:
-            project_repo.git.checkout(branch)
-        except gitExceptions.GitCommandError as gce_except:
-            if "did not match any file(s) known to git" in gce_except.stderr:
-                LOGGER.info(
-                    ("Project {projectname} has no branch {branchname} "
-                     "and will be ignored from the maturity "
-                     "table".format(
-                         projectname=project_shortname,
-                         branchname=branch))
-                )
-                continue
-            else:
-                raise SystemExit("Error checking out branch {}".format(branch))
-
-        role['name'] = project_shortname
-        try:
-            std_meta, _, _ = load_yaml(
-                "{}/meta/main.yml".format(project_path))
-        except IOError:
-            # If no meta/main (like ops), don't count as
-            # a role to update.
+            LOGGER.info("Loading metadata for %s" % project_shortname)
+            row = read_role_metadata(reader, project_sha, project_shortname)
+        roles_state[project_shortname] = {'sha': project_sha, 'row': row}
+        if row is None:
             continue
-        # Only take what you need from standard metadata
-        # Example of standard metadata:
-        # galaxy_info:
-        #   author: rcbops
-        #   description: Installation and setup of neutron
-        #   company: Rackspace
-        #   license: Apache2
-        #   min_ansible_version: 2.2
-        #   platforms:
-        #     - name: Ubuntu
-        #       versions:
-        #         - xenial
-        #     - name: EL
-        #       versions:
-        #         - 7
-        #     - name: opensuse
-        #       versions:
-        #         - 42.1
-        #         - 42.2
-        #         - 42.3
-        #   categories:
-        #     - cloud
-        #     - python
-        #     - neutron
-        #     - development
-        #     - openstack
-        role['opensuse'] = False
-        role['ubuntu'] = False
-        role['centos'] = False
-        for platform in std_meta['galaxy_info']['platforms']:
-            if platform['name'].lower() == 'opensuse':
-                role['opensuse'] = True
-                role['opensuse_versions'] = platform['versions']
-            elif platform['name'].lower() == 'ubuntu':
-                role['ubuntu'] = True
-                role['ubuntu_versions'] = platform['versions']
-            elif (platform['name'].lower() == 'centos' or
-                  platform['name'].upper() == 'EL'):
-                role['centos'] = True
-                role['centos_versions'] = platform['versions']
-        # Example of maturity info metadata:
-        # maturity_info:
-        #     status: complete
-        #     created_during: mitaka
-        try:
-            osa_meta, _, _ = load_yaml(
-                "{}/meta/openstack-ansible.yml".format(project_path))
-        except IOError:
-            role['maturity_level'] = 'unknown'
-            role['created_during'] = 'unknown'
-            role['retired_during'] = 'unknown'
-        else:
-            role['maturity_level'] = osa_meta['maturity_info']['status'].lower()
-            role['created_during'] = osa_meta['maturity_info']['created_during'].lower()
-            role['retired_during'] = osa_meta['maturity_info'].get(
-                'retired_during', 'unknown').lower()
+        role = dict(row)
         # Now checking presence in ansible-role-requirements.yml
-        role['in_arr'] = any(
-            arr_role['name'] == project_shortname for arr_role in arr
-        )
+        role['in_arr'] = project_shortname in arr
         matrix.append(role)
 
     matrix.extend(RETIRED_ROLES)
 
-    # Write file
-    LOGGER.info("Patching OpenStack-Ansible")
-    fpth = "doc/source/contributor/role-maturity-matrix.html"
-    with codecs.open("{}/{}".format(oa_folder, fpth),
-                     mode='w+', encoding='utf-8') as matrix_fh:
-        matrix_fh.write(generate_maturity_matrix_html(matrix))
+    # Only write the matrix files which are missing, edited or outdated
+    matrix_changed = (state.get('branch') != branch or
+                      state.get('matrix') != matrix)
+    previous_sha1s = state.get('output_sha1')
+    if not isinstance(previous_sha1s, dict):
+        previous_sha1s = {}
+    output_sha1s = {}
+    written = []
+    partitions = partition_roles(matrix)
+    for fmt in sorted(set(kwargs['format'])):
+        fpth = MATRIX_FILES[fmt][0]
+        matrix_path = "{}/{}".format(oa_folder, fpth)
+        sha1 = file_sha1(matrix_path)
+        if matrix_changed or sha1 is None or previous_sha1s.get(fpth) != sha1:
+            LOGGER.info("Patching OpenStack-Ansible %s" % fpth)
+            write_maturity_matrix(fmt, partitions, matrix_path)
+            sha1 = file_sha1(matrix_path)
+            written.append(fpth)
+        output_sha1s[fpth] = sha1
+    if not written:
+        LOGGER.info("Maturity matrix unchanged")
+    atomic_write(state_path, json.dumps({
+        'branch': branch,
+        'roles': roles_state,
+        'matrix': matrix,
+        'output_sha1': output_sha1s,
+    }))
     # Commit
-    if kwargs['commit']:
+    if kwargs['commit'] and written:
         message = ("Updating roles maturity\n\n"
                    "Update for the {:%d.%m.%Y}\n").format(datetime.now())
-        oa_repo.index.add([fpth])
-        oa_repo.index.commit(message)
+        with trace_span('git', 'commit'):
+            oa_repo.index.add(written)
+            oa_repo.index.commit(message)
@@ -4,13 +4,16 @@
 from datetime import datetime
 import fileinput
 import glob
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import re
 import shutil
 import subprocess
+import tempfile
+import time
 from urlparse import urlparse
-import xmlrpclib
 
 # Extra Packages
 import click
@@ -46,6 +49,50 @@ WORK_DIR_OPT_PARAMS = dict(default='/tmp/releases',
 COMMIT_OPT = ['--commit/--no-commit']
 COMMIT_PARAMS = dict(default=False,
                      help='commits automatically the generated changes')
+REF_CACHE_TTL_OPT = ['--cache-ttl']
+REF_CACHE_TTL_PARAMS = dict(default=REF_CACHE_TTL, type=int,
+                            help='Seconds before remote refs are listed again')
+REF_CACHE_SIZE_OPT = ['--cache-size']
+REF_CACHE_SIZE_PARAMS = dict(default=REF_CACHE_SIZE,
+                             type=click.IntRange(min=0),
+                             help='Maximum number of remotes kept in cache '
+                                  '(0 disables the cache)')
+REFRESH_OPT = ['--refresh/--no-refresh']
+REFRESH_PARAMS = dict(default=False,
+                      help='ignores cached remote refs and lists them again')
+JOBS_OPT = ['-j', '--jobs']
+JOBS_PARAMS = dict(default=REF_JOBS, type=int,
+                   help='Number of remotes resolved concurrently')
+REF_TIMEOUT_OPT = ['--timeout']
+REF_TIMEOUT_PARAMS = dict(default=REF_TIMEOUT, type=int,
+                          help='Seconds before listing a remote is aborted')
+REF_RETRIES_OPT = ['--retries']
+REF_RETRIES_PARAMS = dict(default=REF_RETRIES, type=int,
+                          help='Number of retries for failing remotes')
+# Number of remotes to show in the slowest remotes summary
+SLOWEST_REMOTES = 5
+FETCH_MODE_OPT = ['--fetch-mode']
+FETCH_MODE_PARAMS = dict(default='shallow', type=click.Choice(FETCH_MODES),
+                         help='How to clone the roles: full history, '
+                              'last commit only (shallow), or without blobs '
+                              '(blobless). Default: shallow')
+MIRROR_OPT = ['--mirror/--no-mirror']
+MIRROR_PARAMS = dict(default=True,
+                     help='reuses the objects of shared bare mirrors '
+                          'instead of downloading them for each clone')
+MIRROR_DIR_OPT = ['--mirror-dir']
+MIRROR_DIR_PARAMS = dict(default=MIRROR_DIR,
+                         type=click.Path(file_okay=False, dir_okay=True,
+                                         resolve_path=True),
+                         help='Folder of the shared bare mirrors')
+PYPI_URL_OPT = ['--pypi-url']
+PYPI_URL_PARAMS = dict(default=PYPI_URL,
+                       help='Python package index to query (JSON API)')
+FORMAT_OPT = ['--format']
+FORMAT_PARAMS = dict(default='table', type=click.Choice(['table', 'json']),
+                     help='Output format')
+# Role folder containing the release notes to copy
+RELEASE_NOTES_PATH = 'releasenotes/notes/'
 # Path to Ansible role requirements in workspace
 ARR_PATH = '/openstack-ansible/ansible-role-requirements.yml'
 
@@ -55,18 +102,62 @@ LOGGER = logging.getLogger(__name__)
 click_log.basic_config(LOGGER)
 
 
+def ref_cache_from_options(options):
+    """ Builds the RefCache of the workdir from the
+    command line options
+    """
+    path = "{}/{}".format(options['workdir'], REF_CACHE_FILE)
+    if options['refresh']:
+        return RefCache(path=path, ttl=options['cache_ttl'],
+                        max_entries=options['cache_size'], refresh=True)
+    return warm(('ref_cache', path), lambda: RefCache(path=path)).reuse(
+        ttl=options['cache_ttl'], max_entries=options['cache_size'])
+
+
+def format_specs(specs):
+    """ Returns requirement specs like [('>=', '1.0'), ('<', '2')]
+    as a string like >=1.0,<2
+    """
+    return ",".join(operator + version for operator, version in specs)
+
+
+def resolve_refs_from_options(queries, ref_cache, options):
+    """ Resolves (url, reference) queries concurrently, following
+    the command line options, and logs the slowest remotes.
+    Returns a dict (url, reference) -> resolved reference.
+    """
+    LOGGER.info("Resolving {} references".format(len(queries)))
+    with trace_span('phase', 'resolve references'):
+        resolved, timings, errors = resolve_remote_refs(
+            queries, jobs=options['jobs'], timeout=options['timeout'],
+            retries=options['retries'], ref_cache=ref_cache)
+    ref_cache.save()
+    slowest = sorted(timings, key=timings.get, reverse=True)
+    LOGGER.info("Slowest remotes:")
+    for url in slowest[:SLOWEST_REMOTES]:
+        LOGGER.info("  {:6.2f}s {}".format(timings[url], url))
+    if errors:
+        for url, error in errors.items():
+            LOGGER.error("Cannot list {}: {}".format(url, error))
+        raise SystemExit("Some remotes could not be resolved")
+    return resolved
+
+
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click_log.simple_verbosity_option(LOGGER)
 @click.option('--branch', required=True)
 @click.option('--version', required=True)
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
 @click.option(*COMMIT_OPT, **COMMIT_PARAMS)
+@click.option(*MIRROR_OPT, **MIRROR_PARAMS)
+@click.option(*MIRROR_DIR_OPT, **MIRROR_DIR_PARAMS)
+@traced
 def update_os_release_file(**kwargs):
     """ Update in tree a release file
     with a given branch (code name) and
-    version (release number) inside a new
-    checkin of the openstack/release repo
-    in your workdir
+    version (release number) inside the
+    checkout of the openstack/release repo
+    in your workdir, reset to its master
     """
 
     LOGGER.info("Doing pre-flight checks")
@@ -112,16 +203,18 @@ def update_os_release_file(**kwargs):
     oa = Repo(oa_folder)
     head_commit = oa.head.commit
     LOGGER.info("OpenStack-Ansible current SHA {}".format(head_commit))
-    if os.path.lexists(releases_folder):
-        click.confirm('Deleting ' + releases_folder + '. OK?', abort=True)
-        shutil.rmtree(releases_folder)
-    releases_repo = Repo.clone_from(
-        url=releases_repo_url,
-        to_path=releases_folder,
-        branch="master")
+    if (os.path.lexists(releases_folder) and
+            has_local_changes(Repo(releases_folder), "master")):
+        click.confirm('Discarding the changes of ' + releases_folder +
+                      '. OK?', abort=True)
+    # The mirror has all the objects, otherwise only fetch the last commit
+    releases_repo = reset_repo(
+        releases_repo_url, releases_folder, "master",
+        mode='full' if kwargs['mirror'] else 'shallow',
+        mirror_dir=kwargs['mirror'] and kwargs['mirror_dir'])
 
     LOGGER.info("Reading ansible-role-requirements")
-    arr, _, _ = load_yaml(kwargs['workdir'] + ARR_PATH)
+    arr = RoleRequirements.read(kwargs['workdir'] + ARR_PATH)
 
     LOGGER.info("Reading releases deliverable for the given branch")
     deliverable_file_path = ('deliverables/' + kwargs['branch'] +
@@ -147,33 +240,44 @@ def update_os_release_file(**kwargs):
 
     # Select OpenStack Projects and rename them for releases.
     # Keep their SHA
-    regex = re.compile('^' + OPENSTACK_REPOS + '/.*')
-    for role in arr:
-        if regex.match(role['src']):
-            deliverable['releases'][-1]['projects'].append(
-                {'repo': urlparse(role['src']).path.lstrip('/'),
-                 'hash': role['version']}
-            )
-
-    with open(deliverable_file, 'w') as df_h:
-        yaml.explicit_start = True
-        yaml.block_seq_indent = bsi
-        yaml.indent = ind
-        yaml.dump(deliverable, df_h)
-        LOGGER.info("Patched!")
+    for role in arr.openstack_roles:
+        deliverable['releases'][-1]['projects'].append(
+            {'repo': urlparse(role.src).path.lstrip('/'),
+             'hash': role.version}
+        )
+
+    with trace_span('yaml', 'dump', path=deliverable_file):
+        with open(deliverable_file, 'w') as df_h:
+            yaml.explicit_start = True
+            yaml.block_seq_indent = bsi
+            yaml.indent = ind
+            yaml.dump(deliverable, df_h)
+            LOGGER.info("Patched!")
 
     if kwargs['commit']:
         message = """Release OpenStack-Ansible {}/{}
 
         """.format(kwargs['branch'], version)
-        releases_repo.index.add([deliverable_file_path])
-        releases_repo.index.commit(message)
+        with trace_span('git', 'commit'):
+            releases_repo.index.add([deliverable_file_path])
+            releases_repo.index.commit(message)
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click_log.simple_verbosity_option(LOGGER)
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
 @click.option(*COMMIT_OPT, **COMMIT_PARAMS)
+@click.option(*REF_CACHE_TTL_OPT, **REF_CACHE_TTL_PARAMS)
+@click.option(*REF_CACHE_SIZE_OPT, **REF_CACHE_SIZE_PARAMS)
+@click.option(*REFRESH_OPT, **REFRESH_PARAMS)
+@click.option(*JOBS_OPT, **JOBS_PARAMS)
+@click.option(*REF_TIMEOUT_OPT, **REF_TIMEOUT_PARAMS)
+@click.option(*REF_RETRIES_OPT, **REF_RETRIES_PARAMS)
+@click.option('--date-only-updates/--no-date-only-updates', default=False,
+              help='also refreshes the date of the unchanged SHAs')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True),
+              help='Writes the SHA changes as JSON in this file')
+@traced
 def bump_upstream_sources(**kwargs):
     """ Bump OpenStack projects SHA in OA repo
     """
@@ -187,6 +291,7 @@ def bump_upstream_sources(**kwargs):
         raise SystemExit(verr)
 
     LOGGER.info("Each file can take a while to update.")
+    ref_cache = ref_cache_from_options(kwargs)
     prevline = {}
     reporegex = re.compile('(?P<project>.*)_git_repo: (?P<remote>.*)')
     branchregex = re.compile(('(?P<project>.*)_git_install_branch: '
@@ -202,21 +307,79 @@ def bump_upstream_sources(**kwargs):
         "nova_consoles.yml",
     ]
 
+    if remote_branch.startswith("stable/"):
+        for filename in update_files[:]:
+            if os.path.basename(filename) in stable_branch_skips:
+                LOGGER.info("Skipping {} for stable branch".format(filename))
+                update_files.remove(filename)
+
+    # First collect all the (remote, branch) to resolve them at once
+    queries = []
+    with trace_span('phase', 'scan repo_packages'):
+        for filename in update_files:
+            remote = None
+            with open(filename, 'r') as update_fh:
+                for line in update_fh:
+                    rrm = reporegex.match(line)
+                    if rrm:
+                        remote = rrm.group('remote')
+                    brm = branchregex.match(line)
+                    if brm and remote:
+                        queries.append((remote, brm.group('branch')))
+    resolved = resolve_refs_from_options(queries, ref_cache, kwargs)
+
+    # Then build the new files in memory, and only write the changed ones
+    changes = []
+    updated_files = []
     for filename in update_files:
-        if remote_branch.startswith("stable/") and \
-                os.path.basename(filename) in stable_branch_skips:
-            LOGGER.info("Skipping {} for stable branch".format(filename))
-            continue
-        LOGGER.info("Updating {}".format(filename))
-        for line in fileinput.input(filename, inplace=True):
+        with open(filename, 'r') as update_fh:
+            lines = update_fh.readlines()
+        new_lines = []
+        for line in lines:
             rrm = reporegex.match(line)
             if rrm:
                 # Extract info of repo line (previous line)
                 # for branch line (current line)
                 prevline['project'] = rrm.group('project')
                 prevline['remote'] = rrm.group('remote')
-            print(branchregex.sub(
-                lambda x: bump_project_sha_with_comments(x, prevline), line)),
+            brm = branchregex.match(line)
+            if brm:
+                new_line = branchregex.sub(
+                    lambda x: bump_project_sha_with_comments(x, prevline,
+                                                             ref_cache,
+                                                             resolved),
+                    line)
+                new_sha = resolved[(prevline['remote'], brm.group('branch'))]
+                if new_sha != brm.group('sha'):
+                    changes.append({
+                        'file': os.path.relpath(filename, oa_folder),
+                        'project': brm.group('project'),
+                        'branch': brm.group('branch'),
+                        'old_sha': brm.group('sha'),
+                        'new_sha': new_sha,
+                    })
+                    line = new_line
+                elif kwargs['date_only_updates']:
+                    line = new_line
+            new_lines.append(line)
+        if new_lines == lines:
+            LOGGER.info("{} unchanged".format(filename))
+            continue
+        LOGGER.info("Updating {}".format(filename))
+        atomic_write(filename, "".join(new_lines))
+        updated_files.append(os.path.relpath(filename, oa_folder))
+
+    if kwargs['report']:
+        with open(kwargs['report'], 'w') as report_fh:
+            json.dump({'changed': bool(updated_files),
+                       'files': updated_files,
+                       'changes': changes},
+                      report_fh, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+
+    if not updated_files:
+        click.echo("All SHAs are up to date, nothing to commit.")
+        return
 
     LOGGER.info("All files patched !")
     msg = ("Update all SHAs for {next_release}\n\n"
@@ -228,9 +391,10 @@ def bump_upstream_sources(**kwargs):
                next_release=os.environ.get('next_release', '<NEW VERSION>'),
                release_changeid=os.environ.get('release_changeid', '<TODO>'),)
     if kwargs['commit']:
-        repo = Repo(oa_folder)
-        repo.git.add('.')
-        repo.index.commit(msg)
+        with trace_span('git', 'commit'):
+            repo = Repo(oa_folder)
+            repo.git.add('.')
+            repo.index.commit(msg)
         click.echo("Commit done. Please verify before review.")
     else:
         click.echo("Here is a commit message you could use:\n")
@@ -240,6 +404,7 @@ def bump_upstream_sources(**kwargs):
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click_log.simple_verbosity_option(LOGGER)
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
+@traced
 def update_role_files(**kwargs):
     """ Bump OpenStack Projects files into their
         OpenStack-Ansible role
@@ -262,6 +427,13 @@ def update_role_files(**kwargs):
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click_log.simple_verbosity_option(LOGGER)
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
+@click.option(*MIRROR_OPT, **MIRROR_PARAMS)
+@click.option(*MIRROR_DIR_OPT, **MIRROR_DIR_PARAMS)
+@click.option(*PYPI_URL_OPT, **PYPI_URL_PARAMS)
+@click.option(*FORMAT_OPT, **FORMAT_PARAMS)
+@click.option(*JOBS_OPT, default=REF_JOBS, type=int,
+              help='Number of concurrent PyPI queries')
+@traced
 def check_global_requirement_pins(**kwargs):
     """ Check if there are new versions of packages in pypy for our pins """
     # Needs:
@@ -269,12 +441,10 @@ def check_global_requirement_pins(**kwargs):
     #   Internet connectivity to PyPI
     #   Internet connectivity to requirements
 
-    pypi = xmlrpclib.ServerProxy(PYPI_URL)
-
     # Find requirements repo details
-    data, _, _ = load_yaml((kwargs['workdir'] + '/openstack-ansible/'
-                            'playbooks/defaults/repo_packages/'
-                            'openstack_services.yml'))
+    data = read_yaml((kwargs['workdir'] + '/openstack-ansible/'
+                      'playbooks/defaults/repo_packages/'
+                      'openstack_services.yml'))
 
     # Clean new requirements repo!
     LOGGER.info("Downloading the requirements repo")
@@ -283,31 +453,54 @@ def check_global_requirement_pins(**kwargs):
         click.confirm('Deleting ' + requirements_folder + '. OK?', abort=True)
         shutil.rmtree(requirements_folder)
 
-    requirements_repo = Repo.clone_from(
-        url=data['requirements_git_repo'],
-        to_path=requirements_folder)
-    requirements_repo.git.checkout(data['requirements_git_install_branch'])
+    requirements_repo = fetch_repo(
+        data['requirements_git_repo'], requirements_folder, None,
+        mirror_dir=kwargs['mirror'] and kwargs['mirror_dir'])
+    with trace_span('git', 'checkout'):
+        requirements_repo.git.checkout(
+            data['requirements_git_install_branch'])
 
+    # Index the constraints by name, keeping the first one
+    upper_constraints = {}
     with open(requirements_folder + '/upper-constraints.txt', 'r') as uc_fh:
-        upper_constraints = uc_fh.read()
+        for cstr in requirementslib.parse(uc_fh):
+            upper_constraints.setdefault(canonical_name(cstr.name), cstr)
 
-    LOGGER.info("Displaying results")
     with open((kwargs['workdir'] +
                '/openstack-ansible/global-requirement-pins.txt'), 'r') as gr:
-        for requirement in requirementslib.parse(gr):
-            cstrs = [cstr for cstr in requirementslib.parse(upper_constraints)
-                     if cstr.name == requirement.name]
-            pypi_pkg = get_pypi_version(pypi, requirement.name)
-            print("Name: {name}\n"
-                  "Current global Requirement Pin: {pin} \n"
-                  "PyPI Latest version: {pypi}\n".format(name=requirement.name,
-                                                         pin=requirement.specs,
-                                                         pypi=pypi_pkg))
-            if cstrs:
-                print("""Upper constraint from OpenStack requirements: {}
-                      """.format(cstrs[0].specs))
-            else:
-                print("Constraint not found in OpenStack requirements\n")
+        requirements = list(requirementslib.parse(gr))
+
+    LOGGER.info("Querying PyPI")
+    pypi_cache_path = "{}/{}".format(kwargs['workdir'], PYPI_CACHE_FILE)
+    pypi_cache = warm(('pypi_cache', pypi_cache_path),
+                      lambda: PypiCache(pypi_cache_path))
+    with trace_span('phase', 'query pypi'):
+        pypi_versions = get_pypi_versions(
+            [requirement.name for requirement in requirements],
+            pypi_url=kwargs['pypi_url'], jobs=kwargs['jobs'],
+            pypi_cache=pypi_cache)
+    pypi_cache.save()
+
+    LOGGER.info("Displaying results")
+    results = []
+    for requirement in requirements:
+        cstr = upper_constraints.get(canonical_name(requirement.name))
+        results.append({
+            'name': requirement.name,
+            'pin': format_specs(requirement.specs),
+            'upper_constraint': format_specs(cstr.specs) if cstr else None,
+            'pypi': pypi_versions[requirement.name],
+        })
+    if kwargs['format'] == 'json':
+        click.echo(json.dumps(results, indent=2, sort_keys=True,
+                              separators=(',', ': ')))
+    else:
+        click.echo(format_table(
+            ['Name', 'Global requirement pin', 'Upper constraint',
+             'PyPI latest version'],
+            [[result['name'], result['pin'],
+              result['upper_constraint'] or 'Not found',
+              result['pypi']] for result in results]))
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
@@ -315,6 +508,19 @@ def check_global_requirement_pins(**kwargs):
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
 @click.option("--external-roles/--no-external-roles", default=False)
 @click.option("--release-notes/--no-release-notes", default=True)
+@click.option(*REF_CACHE_TTL_OPT, **REF_CACHE_TTL_PARAMS)
+@click.option(*REF_CACHE_SIZE_OPT, **REF_CACHE_SIZE_PARAMS)
+@click.option(*REFRESH_OPT, **REFRESH_PARAMS)
+@click.option(*JOBS_OPT, **JOBS_PARAMS)
+@click.option(*REF_TIMEOUT_OPT, **REF_TIMEOUT_PARAMS)
+@click.option(*REF_RETRIES_OPT, **REF_RETRIES_PARAMS)
+@click.option(*FETCH_MODE_OPT, **FETCH_MODE_PARAMS)
+@click.option("--compare-full/--no-compare-full", default=False,
+              help='also clone the roles fully to measure what '
+                   'the fetch mode saves')
+@click.option(*MIRROR_OPT, **MIRROR_PARAMS)
+@click.option(*MIRROR_DIR_OPT, **MIRROR_DIR_PARAMS)
+@traced
 def bump_arr(**kwargs):
     """ Update Roles in Ansible Role Requirements for branch,
     effectively freezing them.
@@ -329,53 +535,101 @@ def bump_arr(**kwargs):
         raise SystemExit(verr)
 
     # Load ARRrrrr (pirate mode)
-    arr, ind, bsi = load_yaml(kwargs['workdir'] + ARR_PATH)
+    arr = RoleRequirements.load(kwargs['workdir'] + ARR_PATH)
+    ref_cache = ref_cache_from_options(kwargs)
 
     # Cleanup before doing anything else
     click.confirm("Deleting all the role folders in workspace {}\n"
                   "Are you sure? ".format(kwargs['workdir']))
 
     # Clone only the OpenStack hosted roles
-    regex = re.compile(OPENSTACK_REPOS + '/(.*)')
-    for role in arr:
-        LOGGER.info("Updating {} SHA".format(role['name']))
-        role_path = kwargs['workdir'] + '/' + role['name']
-        if regex.match(role['src']):
-            if os.path.lexists(role_path):
-                shutil.rmtree(role_path)
-            # We need to clone instead of ls-remote-ing this
-            # way we can rsync the release notes
-            role_repo = Repo.clone_from(
-                url=role['src'],
-                to_path=role_path,
-                branch=remote_branch,
-            )
-            role['version'] = "{}".format(role_repo.head.commit)
-            if kwargs['release_notes']:
-                LOGGER.info("Copying role release notes...")
-                release_notes_files = glob.glob(
-                    "{}/releasenotes/notes/*.yaml".format(role_path))
-                LOGGER.debug(release_notes_files)
-                for filepath in release_notes_files:
+    openstack_roles = arr.openstack_roles
+
+    # Mirroring the full history of the roles would cost more than
+    # the shallow and blobless clones save, only full clones use it
+    mirror_dir = (kwargs['mirror'] and kwargs['fetch_mode'] == 'full' and
+                  kwargs['mirror_dir'])
+
+    def fetch_role(role):
+        """ Clones a role, returns its sha and the clone statistics """
+        role_path = kwargs['workdir'] + '/' + role.name
+        if os.path.lexists(role_path):
+            shutil.rmtree(role_path)
+        # We need to clone instead of ls-remote-ing this
+        # way we can rsync the release notes
+        start = time.time()
+        mirror_size = mirror_dir and mirror_objects_size(role.src, mirror_dir)
+        role_repo = fetch_repo(role.src, role_path, remote_branch,
+                               mode=kwargs['fetch_mode'],
+                               sparse_paths=[RELEASE_NOTES_PATH],
+                               mirror_dir=mirror_dir)
+        stats = {'size': git_objects_size(role_repo),
+                 'time': time.time() - start}
+        if mirror_dir:
+            # What the mirror fetched for this clone
+            stats['size'] += (mirror_objects_size(role.src, mirror_dir) -
+                              mirror_size)
+        if kwargs['compare_full']:
+            full_path = tempfile.mkdtemp(dir=kwargs['workdir'])
+            try:
+                start = time.time()
+                full_repo = fetch_repo(role.src, full_path, remote_branch)
+                stats['full_size'] = git_objects_size(full_repo)
+                stats['full_time'] = time.time() - start
+            finally:
+                shutil.rmtree(full_path)
+        return "{}".format(role_repo.head.commit), stats
+
+    LOGGER.info("Cloning {} roles ({})".format(len(openstack_roles),
+                                               kwargs['fetch_mode']))
+    pool = ThreadPool(max(1, kwargs['jobs']))
+    try:
+        with trace_span('phase', 'clone roles'):
+            fetched = pool.map(fetch_role, openstack_roles)
+    finally:
+        pool.close()
+        pool.join()
+
+    totals = dict.fromkeys(['size', 'time', 'full_size', 'full_time'], 0)
+    for role, (sha, stats) in zip(openstack_roles, fetched):
+        LOGGER.info("Updated {} SHA".format(role.name))
+        LOGGER.debug("{name}: {size} bytes in {time:.2f}s".format(
+            name=role.name, **stats))
+        role.version = sha
+        for key in stats:
+            totals[key] += stats[key]
+        if kwargs['release_notes']:
+            LOGGER.info("Copying role release notes...")
+            release_notes_files = glob.glob("{}/{}/{}*.yaml".format(
+                kwargs['workdir'], role.name, RELEASE_NOTES_PATH))
+            LOGGER.debug(release_notes_files)
+            for filepath in release_notes_files:
+                with trace_span('io', 'rsync', path=filepath):
                     subprocess.call(
                         ["rsync", "-aq",
                          filepath,
-                         "{}/releasenotes/notes/".format(oa_folder)])
-
-        elif kwargs['external_roles']:
-            # For external roles, don't clone,
-            # find the latest "matching" tag (patch release)
-            # or the latest sha (master)
-            role['version'] = find_latest_remote_ref(role['src'],
-                                                     role['version'])
-
-    with open(kwargs['workdir'] + ARR_PATH, 'w') as role_req_file:
-        yaml = YAML()
-        yaml.default_flow_style = False
-        yaml.block_seq_indent = bsi
-        yaml.indent = ind
-        yaml.dump(arr, role_req_file)
-        LOGGER.info("Ansible Role Requirements file patched!")
+                         "{}/{}".format(oa_folder, RELEASE_NOTES_PATH)])
+
+    LOGGER.info("Fetched {size} bytes in {time:.2f}s".format(**totals))
+    if kwargs['compare_full']:
+        LOGGER.info("Full clones: {full_size} bytes in {full_time:.2f}s, "
+                    "saved {saved_size} bytes and {saved_time:.2f}s".format(
+                        saved_size=totals['full_size'] - totals['size'],
+                        saved_time=totals['full_time'] - totals['time'],
+                        **totals))
+
+    if kwargs['external_roles']:
+        # For external roles, don't clone,
+        # find the latest "matching" tag (patch release)
+        # or the latest sha (master)
+        resolved = resolve_refs_from_options(
+            [(role.src, role.version) for role in arr.external_roles],
+            ref_cache, kwargs)
+        for role in arr.external_roles:
+            role.version = resolved[(role.src, role.version)]
+
+    arr.dump(kwargs['workdir'] + ARR_PATH)
+    LOGGER.info("Ansible Role Requirements file patched!")
 
     msg = ("Here is a commit message you could use:\n"
            "Update all SHAs for {new_version}\n\n"
@@ -395,6 +649,7 @@ def bump_arr(**kwargs):
 @click.option(*WORK_DIR_OPT, **WORK_DIR_OPT_PARAMS)
 @click.option('--version', default="auto")
 @click.option(*COMMIT_OPT, **COMMIT_PARAMS)
+@traced
 def bump_oa_release_number(**kwargs):
     """ Update OpenStack Ansible version number in code """
 
@@ -418,11 +673,12 @@ def bump_oa_release_number(**kwargs):
     else:
         nver = kwargs['version']
 
-    for line in fileinput.input("{}/{}".format(oa_folder, fpth),
-                                inplace=True):
-        print(line.replace(
-            "openstack_release: {}".format(cver),
-            "openstack_release: {}".format(nver))),
+    with trace_span('io', 'rewrite', path=fpth):
+        for line in fileinput.input("{}/{}".format(oa_folder, fpth),
+                                    inplace=True):
+            print(line.replace(
+                "openstack_release: {}".format(cver),
+                "openstack_release: {}".format(nver))),
     LOGGER.info("Updated the version in repo to {}".format(nver))
 
     msg = ("Here is a commit message you could use:\n"
@@ -436,9 +692,10 @@ def bump_oa_release_number(**kwargs):
                release_changeid=os.environ.get('release_changeid', '<TODO>'))
 
     if kwargs['commit']:
-        repo = Repo(oa_folder)
-        repo.git.add('.')
-        repo.index.commit(msg)
+        with trace_span('git', 'commit'):
+            repo = Repo(oa_folder)
+            repo.git.add('.')
+            repo.index.commit(msg)
         click.echo("Commit done. Please verify before review.")
     else:
         click.echo(msg)
@@ -4,12 +4,17 @@ from setuptools import setup
 setup(
     name='osa_toolkit',
     version='0.1',
-    py_modules=['release', 'maturity', 'bugtriage'],
+    py_modules=['release', 'maturity', 'bugtriage', 'toolkit', 'cli', 'daemon',
+                'client'],
     install_requires=[
         'Click',
         'click-log',
         'GitPython',
         'Jinja2',
+        'launchpadlib',
+        'numpy',
+        'packaging',
+        'requests',
         'requirements-parser',
         'ruamel.yaml',
         'semver'
@@ -24,5 +29,9 @@ setup(
         update-os-release-file=release:update_os_release_file
         update-role-maturity-matrix=maturity:update_role_maturity_matrix
         generate-bug-triage-page=bugtriage:generate_page
+        bug-trends=bugtriage:bug_trends
+        osa-toolkit=cli:main
+        osa-toolkit-daemon=daemon:serve
+        osa-toolkit-client=client:main
     ''',
 )
@@ -0,0 +1,143 @@
+""" Tests of the local bug store sync, against a stub Launchpad """
+from datetime import datetime, timedelta
+import unittest
+
+import bugtriage
+
+
+class StubTask(object):
+    """ Bug task, with the attributes read by bugtriage """
+    def __init__(self, bug_id, title, status, date_created):
+        self.bug_link = 'https://api.launchpad.net/devel/bugs/{}'.format(
+            bug_id)
+        self.title = 'Bug #{} in openstack-ansible: "{}"'.format(bug_id,
+                                                                 title)
+        self.web_link = 'https://bugs.launchpad.net/bugs/{}'.format(bug_id)
+        self.status = status
+        self.importance = 'Undecided'
+        self.date_created = date_created
+        self.date_left_new = None
+        self.date_closed = None
+        self.date_last_updated = date_created
+        self.duplicate_of = None
+
+
+class StubProject(object):
+    """ Launchpad project, recording its searchTasks calls """
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.searches = []
+        self.found = []
+
+    def searchTasks(self, status, order_by, modified_since=None,
+                    omit_duplicates=True):
+        self.searches.append({'status': status,
+                              'modified_since': modified_since,
+                              'omit_duplicates': omit_duplicates})
+        tasks = [task for task in self.tasks
+                 if task.status in status and
+                 (modified_since is None or
+                  bugtriage.isodate(task.date_last_updated) >= modified_since)
+                 and not (omit_duplicates and task.duplicate_of)]
+        self.found.append([task.bug_link for task in tasks])
+        return tasks
+
+
+class StubLaunchpad(object):
+    """ Launchpad service, with launchpad.projects[name] """
+    def __init__(self, projects):
+        self.projects = projects
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = bugtriage.open_store(':memory:')
+        old = datetime.utcnow() - timedelta(days=30)
+        self.tasks = [StubTask(1, "nova fails", 'New', old),
+                      StubTask(2, "keystone fails", 'New', old),
+                      StubTask(3, "fixed long ago", 'Fix Released', old)]
+        self.project = StubProject(self.tasks)
+        self.launchpad = StubLaunchpad({'openstack-ansible': self.project})
+
+    def sync(self):
+        failed = bugtriage.sync_projects(self.conn, lambda: self.launchpad,
+                                         ['openstack-ansible'], ['New'])
+        self.assertEqual(failed, [])
+
+    def update(self, task, status):
+        task.status = status
+        task.date_last_updated = datetime.utcnow()
+        if status != 'New':
+            task.date_left_new = task.date_last_updated
+
+    def page_bug_ids(self):
+        return [int(line.split()[1].rsplit('/', 1)[-1])
+                for line in bugtriage.iter_page_lines(self.conn, ['New'])]
+
+    def test_first_sync_fetches_states(self):
+        self.sync()
+        self.assertEqual(self.project.searches,
+                         [{'status': ['New'], 'modified_since': None,
+                           'omit_duplicates': True}])
+        self.assertEqual(self.page_bug_ids(), [1, 2])
+        self.assertIsNotNone(bugtriage.get_watermark(
+            self.conn, 'openstack-ansible', ['New']))
+
+    def test_incremental_sync_past_watermark(self):
+        self.sync()
+        watermark = bugtriage.get_watermark(self.conn, 'openstack-ansible',
+                                            ['New'])
+        self.update(self.tasks[2], 'New')
+        self.sync()
+        self.assertEqual(self.project.searches[1],
+                         {'status': bugtriage.ALL_STATES,
+                          'modified_since': watermark,
+                          'omit_duplicates': False})
+        # Only the reopened bug was modified since the watermark
+        self.assertEqual(self.project.found[1], [self.tasks[2].bug_link])
+        self.assertEqual(self.page_bug_ids(), [1, 2, 3])
+
+    def test_status_history(self):
+        self.sync()
+        self.update(self.tasks[0], 'Confirmed')
+        self.sync()
+        self.update(self.tasks[0], 'Triaged')
+        self.sync()
+        self.assertEqual([row[0] for row in self.conn.execute(
+            "SELECT status FROM history WHERE bug_id = ? ORDER BY rowid",
+            (1,))], ['New', 'Confirmed', 'Triaged'])
+        # An unchanged bug only has its first status
+        self.assertEqual([row[0] for row in self.conn.execute(
+            "SELECT status FROM history WHERE bug_id = ?", (2,))], ['New'])
+
+    def test_bug_leaving_new_drops_off_page(self):
+        self.sync()
+        self.assertEqual(self.page_bug_ids(), [1, 2])
+        self.update(self.tasks[1], 'Confirmed')
+        self.sync()
+        self.assertEqual(self.page_bug_ids(), [1])
+        self.assertIsNotNone(self.conn.execute(
+            "SELECT date_left_new FROM tasks WHERE bug_id = ?",
+            (2,)).fetchone()[0])
+
+    def test_duplicate_drops_off_page_and_index(self):
+        self.sync()
+        index = bugtriage.BugIndex(':memory:')
+        index.update(self.conn)
+        self.assertIn(2, index.rows)
+        self.tasks[1].duplicate_of = 1
+        self.tasks[1].date_last_updated = datetime.utcnow()
+        self.sync()
+        self.assertEqual(self.page_bug_ids(), [1])
+        self.assertEqual([row[0] for row in self.conn.execute(
+            "SELECT status FROM history WHERE bug_id = ? ORDER BY rowid",
+            (2,))], ['New', bugtriage.DUPLICATE])
+        index.update(self.conn)
+        self.assertNotIn(2, index.rows)
+        self.assertEqual(index.bug_ids.tolist(), [1])
+        self.assertEqual(index.similar(1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
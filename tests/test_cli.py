@@ -0,0 +1,60 @@
+""" Tests of the osa-toolkit start-up, which only imports
+the module of the command which is run
+"""
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules which osa-toolkit --help must not import
+LAZY_MODULES = ['bugtriage', 'git', 'jinja2', 'launchpadlib', 'maturity',
+                'numpy', 'release', 'requests', 'requirements', 'semver',
+                'toolkit']
+# Runs osa-toolkit --help, then outputs the lazy modules it imported
+STARTUP_CHECK = """
+import sys
+import cli
+try:
+    cli.main(['--help'])
+except SystemExit:
+    pass
+sys.stderr.write(' '.join(sorted(set(sys.modules) & set({}))))
+""".format(LAZY_MODULES)
+# Maximum seconds osa-toolkit --help may add to the interpreter start-up
+STARTUP_BUDGET = 0.1
+
+
+def measure_startup(repeat=5, env=None):
+    """ Times osa-toolkit --help against an empty interpreter.
+    Returns the best time of both and the lazy modules imported.
+    """
+    durations = {'baseline': [], 'help': []}
+    imported = []
+    for _ in range(max(5, repeat)):
+        for name, code in [('baseline', 'pass'), ('help', STARTUP_CHECK)]:
+            start = time.time()
+            process = subprocess.Popen(
+                [sys.executable, '-c', code], cwd=ROOT_DIR, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _, stderr = process.communicate()
+            durations[name].append(time.time() - start)
+            if name == 'help':
+                imported = stderr.decode('utf-8').split()
+    baseline = min(durations['baseline'])
+    return {'baseline': round(baseline, 4),
+            'seconds': round(min(durations['help']) - baseline, 4),
+            'imported': imported}
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_help_is_lazy_and_fast(self):
+        startup = measure_startup()
+        self.assertEqual(startup['imported'], [])
+        self.assertLessEqual(startup['seconds'], STARTUP_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
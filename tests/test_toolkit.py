@@ -0,0 +1,55 @@
+""" Tests of the remote refs resolution, against a local git remote """
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import toolkit
+
+
+def git(*args, **kwargs):
+    subprocess.check_call(('git',) + args, stdout=open(os.devnull, 'w'),
+                          **kwargs)
+
+
+class ResolveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.url = os.path.join(self.tmp, 'role')
+        git('init', '-q', self.url)
+        git('-c', 'user.name=test', '-c', 'user.email=test@example.com',
+            'commit', '-q', '--allow-empty', '-m', 'init', cwd=self.url)
+        git('branch', 'stable/pike', cwd=self.url)
+        for tag in ['16.0.9', '16.0.10', 'ocata-eol']:
+            git('tag', tag, cwd=self.url)
+        self.head = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=self.url).decode().strip()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def resolve(self, ref_cache):
+        queries = [(self.url, 'stable/pike'), (self.url, 'stable/ocata'),
+                   (self.url, '16.0.2')]
+        resolved, _, errors = toolkit.resolve_remote_refs(
+            queries, jobs=2, ref_cache=ref_cache)
+        self.assertEqual(errors, {})
+        return [resolved[query] for query in queries]
+
+    def test_resolve(self):
+        self.assertEqual(self.resolve(toolkit.RefCache()),
+                         [self.head, 'ocata-eol', '16.0.10'])
+
+    def test_resolve_without_cache(self):
+        ref_cache = toolkit.RefCache(max_entries=0)
+        self.assertEqual(self.resolve(ref_cache),
+                         [self.head, 'ocata-eol', '16.0.10'])
+        self.assertEqual(len(ref_cache.entries), 0)
+        self.assertEqual(toolkit.find_latest_remote_ref(
+            self.url, '16.0.2', ref_cache=ref_cache), '16.0.10')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,28 +1,204 @@
 """ Convenient functions for releasing and other
     openstack-ansible purposes
 """
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+import functools
+import json
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from urlparse import urlparse
 
+import click
 from git import cmd as gitcmd           # GitPython package
+from git import exc as gitExceptions
 from git import Repo
+from git.refs.symbolic import SymbolicReference
+from packaging.version import InvalidVersion, Version
+import requests
+from ruamel.yaml import YAML
+from ruamel.yaml import events as yamlEvents
 from ruamel.yaml.util import load_yaml_guess_indent
 
 
 # Generic URLs
-OPENSTACK_REPOS = "https://git.openstack.org/openstack"
-PROJECT_CONFIG_REPO = OPENSTACK_REPOS + "-infra/project-config"
-PYPI_URL = "https://pypi.python.org/pypi"
+OPENSTACK_REPOS = os.environ.get('OSA_TOOLKIT_OPENSTACK_REPOS',
+                                 "https://git.openstack.org/openstack")
+PROJECT_CONFIG_REPO = os.environ.get('OSA_TOOLKIT_PROJECT_CONFIG_REPO',
+                                     OPENSTACK_REPOS +
+                                     "-infra/project-config")
+PYPI_URL = os.environ.get('OSA_TOOLKIT_PYPI_URL', "https://pypi.org/pypi")
+PYPI_TIMEOUT = 30
+PYPI_CACHE_FILE = 'cache/pypi.json'
 
 # OA_VARS
 OA_VERSION_FILES = ["inventory/group_vars/all/all.yml",
                     "group_vars/all/all.yml",
                     "playbooks/inventory/group_vars/all.yml"]
 
+# Number of parsed YAML documents kept in memory by read_yaml
+YAML_CACHE_SIZE = 128
+YAML_CACHE = OrderedDict()
+YAML_CACHE_LOCK = threading.Lock()
+
+# Remote refs cache defaults
+REF_CACHE_FILE = 'cache/remote_refs.json'
+REF_CACHE_TTL = 3600
+REF_CACHE_SIZE = 256
+
+# Concurrent remote resolution defaults
+REF_JOBS = 8
+REF_TIMEOUT = 60
+REF_RETRIES = 2
+
+# Clone modes: full history, last commit only, or commits without blobs
+FETCH_MODES = ('full', 'shallow', 'blobless')
+
+# Shared bare mirrors of the remotes, reused by all the workdirs
+MIRROR_DIR = os.environ.get('OSA_TOOLKIT_MIRROR_DIR',
+                            os.path.expanduser('~/.cache/osa_toolkit/mirrors'))
+# One lock per mirror path, to update each mirror only once at a time
+MIRROR_LOCKS = {}
+MIRROR_LOCKS_LOCK = threading.Lock()
+# Refs fetched into the mirrors, without the gerrit refs/changes/*
+MIRROR_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
 # Default variables for click help behavior
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
+# Objects kept between the commands served by the daemon
+# (see daemon.py), None when running a single command
+WARM_OBJECTS = None
+WARM_LOCK = threading.Lock()
+
+# Spans recorder of the running command, None when not tracing
+TRACER = None
+TRACE_OPT = ['--trace']
+TRACE_PARAMS = dict(default=None, type=click.Path(dir_okay=False,
+                                                  writable=True),
+                    help='Writes a Chrome trace (chrome://tracing) '
+                         'of the command to this file')
+PROFILE_OPT = ['--profile/--no-profile']
+PROFILE_PARAMS = dict(default=False,
+                      help='Prints the time spent in each operation')
+
+
+class Tracer(object):
+    """ Records the spans (named and timed operations) of a
+    command, from all its threads.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, category, name, start, duration, args):
+        """ Records a span """
+        with self.lock:
+            self.spans.append((category, name, start, duration,
+                               threading.current_thread().ident, args))
+
+    def chrome_trace(self):
+        """ Returns the spans in the Chrome trace event format """
+        events = []
+        threads = {}
+        for category, name, start, duration, thread, args in self.spans:
+            events.append({
+                'name': name, 'cat': category, 'ph': 'X',
+                'ts': int((start - self.start) * 1e6),
+                'dur': int(duration * 1e6),
+                'pid': os.getpid(),
+                'tid': threads.setdefault(thread, len(threads)),
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def summary(self):
+        """ Returns the count, total and max duration of the spans
+        of each category and name, longest total first.
+        """
+        totals = {}
+        for category, name, _, duration, _, _ in self.spans:
+            total = totals.setdefault((category, name), [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+        return sorted(([category, name] + total
+                       for (category, name), total in totals.items()),
+                      key=lambda row: -row[3])
+
+
+@contextmanager
+def trace_span(category, name, **args):
+    """ Records the duration of the code in the with block,
+    if a command is traced (see traced). args are shown
+    in the trace. Does nothing otherwise.
+    """
+    tracer = TRACER
+    if tracer is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        tracer.add(category, name, start, time.time() - start, args)
+
+
+def traced(command):
+    """ Adds the --trace and --profile options to a click
+    command function, which record the spans of the command
+    (see trace_span).
+    """
+    @click.option(*TRACE_OPT, **TRACE_PARAMS)
+    @click.option(*PROFILE_OPT, **PROFILE_PARAMS)
+    @functools.wraps(command)
+    def wrapper(**kwargs):
+        global TRACER
+        trace_path = kwargs.pop('trace')
+        profile = kwargs.pop('profile')
+        if not trace_path and not profile:
+            return command(**kwargs)
+        TRACER = Tracer()
+        try:
+            with trace_span('command', command.__name__):
+                return command(**kwargs)
+        finally:
+            tracer, TRACER = TRACER, None
+            if trace_path:
+                with open(trace_path, 'w') as trace_fh:
+                    json.dump(tracer.chrome_trace(), trace_fh)
+            if profile:
+                click.echo(format_table(
+                    ['Category', 'Operation', 'Count', 'Total (s)',
+                     'Max (s)'],
+                    [[category, name, str(count), '{:.3f}'.format(total),
+                      '{:.3f}'.format(longest)]
+                     for category, name, count, total, longest
+                     in tracer.summary()]), err=True)
+    return wrapper
+
+
+def warm(key, factory):
+    """ Returns the object built by factory for key.
+    In the daemon, the object is only built once, and
+    reused by the next commands.
+    """
+    if WARM_OBJECTS is None:
+        return factory()
+    with WARM_LOCK:
+        if key not in WARM_OBJECTS:
+            WARM_OBJECTS[key] = factory()
+        return WARM_OBJECTS[key]
+
 
 def load_yaml(path, mode='r'):
     """ Extract contents and indent details
@@ -33,24 +209,256 @@ def load_yaml(path, mode='r'):
         YAML().block_seq_indent
         YAML().indent
     """
-    with open(path, mode) as fhdle:
-        (data, ind, bsi) = load_yaml_guess_indent(fhdle)
-        return (data, ind, bsi)
+    with trace_span('yaml', 'load_yaml', path=path):
+        with open(path, mode) as fhdle:
+            (data, ind, bsi) = load_yaml_guess_indent(fhdle)
+            return (data, ind, bsi)
+
 
+def parse_yaml(content, key=None):
+    """ Parses YAML content with the safe loader, which
+    is C accelerated when available. Returns the data.
+    If key is given (like a blob sha), the data is cached
+    under that key, with the YAML_CACHE_SIZE most
+    recently used documents.
+    The data is shared between callers: don't modify it.
+    """
+    if key is not None:
+        with YAML_CACHE_LOCK:
+            if key in YAML_CACHE:
+                data = YAML_CACHE.pop(key)
+                YAML_CACHE[key] = data
+                return data
+    with trace_span('yaml', 'parse_yaml'):
+        data = YAML(typ='safe').load(content)
+    if key is not None:
+        with YAML_CACHE_LOCK:
+            YAML_CACHE[key] = data
+            while len(YAML_CACHE) > YAML_CACHE_SIZE:
+                YAML_CACHE.popitem(last=False)
+    return data
+
+
+def read_yaml(path):
+    """ Returns the data of a YAML file which will not be
+    written back, faster than load_yaml.
+    Documents are cached by path, modification time and size
+    (see parse_yaml), don't modify the data.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    with YAML_CACHE_LOCK:
+        cached = key in YAML_CACHE
+    if cached:
+        return parse_yaml(None, key)
+    with open(path, 'r') as fhdle:
+        return parse_yaml(fhdle, key)
+
+
+def atomic_write(path, content):
+    """ Writes content to path through a temporary file
+    renamed over path, so that path is never half written.
+    Keeps the permissions of path if it exists.
+    """
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with trace_span('io', 'atomic_write', path=path):
+        fd, tmp_path = tempfile.mkstemp(dir=folder)
+        try:
+            with os.fdopen(fd, mode) as tmp_fh:
+                tmp_fh.write(content)
+                tmp_fh.flush()
+                os.fsync(tmp_fh.fileno())
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp_path, 0o666 & ~umask)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+def canonical_name(pkg_name):
+    """ Returns the normalized name of a python package (PEP 503),
+    to compare names like oslo.config and Oslo_Config.
+    """
+    return re.sub('[-_.]+', '-', pkg_name).lower()
+
+
+def pypi_session(pool_size=1):
+    """ Returns a requests Session keeping up to pool_size
+    connections open to PyPI, to share between threads.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class PypiCache(object):
+    """ Cache of the PyPI release lists, keyed by package name,
+    saved as JSON on disk (usually under the workdir).
+    Each entry keeps the ETag and Last-Modified of the PyPI
+    response, to revalidate it with conditional requests,
+    and the latest stable version of the package.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        # the cache is shared by the PyPI query threads
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as cache_fh:
+                try:
+                    self.entries = json.load(cache_fh)
+                except ValueError:
+                    self.entries = {}
+
+    def get(self, pkg_name):
+        """ Returns the cached entry of a package, or None """
+        with self.lock:
+            return self.entries.get(canonical_name(pkg_name))
+
+    def set(self, pkg_name, entry):
+        """ Stores the entry of a package """
+        with self.lock:
+            self.entries[canonical_name(pkg_name)] = entry
+
+    def save(self):
+        """ Writes the cache to disk, if it has a path """
+        if not self.path:
+            return
+        with self.lock:
+            content = json.dumps(self.entries)
+        atomic_write(self.path, content)
+
+
+def latest_stable_version(releases):
+    """ Returns the highest final release (PEP 440 ordering)
+    of a list of version strings, or None if there is none.
+    """
+    versions = []
+    for release in releases:
+        try:
+            version = Version(release)
+        except InvalidVersion:
+            continue
+        if not version.is_prerelease:
+            versions.append((version, release))
+    if versions:
+        return max(versions)[1]
+    return None
 
-def get_pypi_version(pypi_connection, pkg_name):
+
+def get_pypi_version(session, pkg_name, pypi_url=PYPI_URL, pypi_cache=None):
     """Get the current package version from PyPI.
-    Expects a xmlrpclib connection to PyPi server
+    Expects a requests session (see pypi_session)
     and a package name as mandatory arguments.
+    Uses the JSON API of the index at pypi_url.
+    If pypi_cache (a PypiCache) is given, the cached
+    release list is revalidated instead of downloaded.
     """
-    pkg_result = [v for v in pypi_connection.package_releases(pkg_name, True)
-                  if not re.compile('a|b|rc').search(v)]
-    if pkg_result:
-        pkg_version = pkg_result[0]
-    else:
-        pkg_version = 'Not available.'
+    entry = pypi_cache.get(pkg_name) if pypi_cache is not None else None
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    with trace_span('network', 'pypi', package=pkg_name):
+        response = session.get('{}/{}/json'.format(pypi_url, pkg_name),
+                               headers=headers, timeout=PYPI_TIMEOUT)
+    if response.status_code == 304 and entry:
+        return entry['latest'] or 'Not available.'
+    if response.status_code != 200:
+        return 'Not available.'
+    # Ignore the releases whose files were all yanked
+    releases = [release for release, files
+                in response.json()['releases'].items()
+                if not files or not all(pkg_file.get('yanked')
+                                        for pkg_file in files)]
+    entry = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'releases': releases,
+        'latest': latest_stable_version(releases),
+    }
+    if pypi_cache is not None:
+        pypi_cache.set(pkg_name, entry)
+    return entry['latest'] or 'Not available.'
+
+
+def get_pypi_versions(pkg_names, pypi_url=PYPI_URL, jobs=REF_JOBS,
+                      pypi_cache=None):
+    """ Get the current versions of many packages from PyPI,
+    querying jobs packages at once over the same connections.
+    Returns a dict package name -> version.
+    """
+    session = warm(('pypi_session', jobs), lambda: pypi_session(jobs))
+    pool = ThreadPool(max(1, jobs))
+    try:
+        versions = pool.map(
+            lambda pkg_name: get_pypi_version(session, pkg_name, pypi_url,
+                                              pypi_cache),
+            pkg_names)
+    finally:
+        pool.close()
+        pool.join()
+        if WARM_OBJECTS is None:
+            session.close()
+    return dict(zip(pkg_names, versions))
 
-    return pkg_version
+
+def format_table(headers, rows):
+    """ Returns rows (lists of strings) as a text table
+    with aligned columns.
+    """
+    widths = [max(len(cell) for cell in column)
+              for column in zip(headers, *rows)]
+    lines = []
+    for row in [headers, ['-' * width for width in widths]] + rows:
+        lines.append("  ".join(cell.ljust(width)
+                               for cell, width in zip(row, widths)).rstrip())
+    return "\n".join(lines)
+
+
+def iter_yaml_list_values(stream, key):
+    """ Yields, while parsing, the scalar value of key in each
+    mapping of a YAML file made of a list of mappings,
+    like gerrit/projects.yaml:
+      - project: openstack/nova
+        description: ...
+    Nothing else is kept in memory.
+    """
+    # One [is_mapping, expecting_key, last_key] per open collection
+    stack = []
+    for event in YAML(typ='safe').parse(stream):
+        if isinstance(event, yamlEvents.CollectionEndEvent):
+            stack.pop()
+            continue
+        if not isinstance(event, yamlEvents.NodeEvent):
+            continue
+        parent = stack[-1] if stack else None
+        is_key = False
+        if parent is not None and parent[0]:
+            is_key = parent[1]
+            parent[1] = not is_key
+        if (isinstance(event, yamlEvents.ScalarEvent) and
+                len(stack) == 2 and not stack[0][0]):
+            if is_key:
+                parent[2] = event.value
+            elif parent[0] and parent[2] == key:
+                yield event.value
+        elif isinstance(event, yamlEvents.CollectionStartEvent):
+            stack.append([isinstance(event, yamlEvents.MappingStartEvent),
+                          True, None])
 
 
 def get_oa_version(osa_folder):
@@ -62,69 +470,827 @@ def get_oa_version(osa_folder):
     for filename in OA_VERSION_FILES:
         var_file = "{}/{}".format(osa_folder, filename)
         if os.path.exists(var_file):
-            data, _, _ = load_yaml(var_file)
+            data = read_yaml(var_file)
             if data.get('openstack_release'):
                 return filename, data.get('openstack_release')
 
 
-def find_latest_remote_ref(url, reference, guess=True):
-    """ Discovers, from a git remote, the latest
-        "appropriate" tag/sha based on a reference:
-        If reference is a branch, returns the sha
-        for the head of the branch.
-        If reference is a tag, find the latest patch
-        release of the same tag line.
+class RefCache(object):
+    """ Cache of ls-remote listings, keyed by remote URL
+    and listed ref prefixes (see ref_cache_key).
+    Listings are kept in memory for the current run and
+    saved as JSON on disk (usually under the workdir) for
+    the next runs.
+    Entries older than ttl seconds are fetched again, and
+    the least recently used remotes are evicted when more
+    than max_entries are stored.
+    If refresh is set, entries from disk are ignored and
+    replaced by fresh listings.
+    With max_entries set to 0, nothing is cached.
+    """
+
+    def __init__(self, path=None, ttl=REF_CACHE_TTL,
+                 max_entries=REF_CACHE_SIZE, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.entries = OrderedDict()
+        # remotes listed during this run, always valid
+        self.fetched = set()
+        # url -> (listing, RefIndex of the listing)
+        self.indexes = {}
+        # the cache is shared by the resolver threads
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as cache_fh:
+                try:
+                    entries = json.load(cache_fh)
+                except ValueError:
+                    entries = {}
+            for url in sorted(entries, key=lambda u: entries[u]['used']):
+                self.entries[url] = entries[url]
+
+    def reuse(self, ttl=REF_CACHE_TTL, max_entries=REF_CACHE_SIZE):
+        """ Prepares a cache kept in memory (see warm) for another
+        command: the listings of the previous commands expire
+        like the ones read from disk.
+        """
+        with self.lock:
+            self.ttl = ttl
+            self.max_entries = max_entries
+            self.fetched.clear()
+        return self
+
+    def get(self, url):
+        """ Returns the cached listing of a remote, or None
+        if missing, expired or refreshing.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if url not in self.fetched:
+                if self.refresh or time.time() - entry['fetched'] > self.ttl:
+                    return None
+            # Mark as most recently used
+            entry['used'] = time.time()
+            del self.entries[url]
+            self.entries[url] = entry
+            return entry['refs']
+
+    def set(self, url, refs):
+        """ Stores the listing of a remote, evicting the least
+        recently used remotes if the cache is full.
+        """
+        now = time.time()
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = {'fetched': now, 'used': now, 'refs': refs}
+            self.fetched.add(url)
+            self.indexes.pop(url, None)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.indexes.pop(evicted, None)
+
+    def index(self, url):
+        """ Returns the RefIndex of the cached listing of a remote,
+        built once per listing, or None (see get).
+        """
+        refs = self.get(url)
+        if refs is None:
+            return None
+        with self.lock:
+            cached = self.indexes.get(url)
+            if cached is not None and cached[0] is refs:
+                return cached[1]
+        index = RefIndex(refs)
+        self.set_index(url, refs, index)
+        return index
+
+    def set_index(self, url, refs, index):
+        """ Keeps the RefIndex of the listing refs of a remote,
+        if that listing is still the one in cache.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry['refs'] is refs:
+                self.indexes[url] = (refs, index)
+
+    def save(self):
+        """ Writes the cache to disk, if it has a path """
+        if not self.path:
+            return
+        with self.lock:
+            content = json.dumps(self.entries)
+        atomic_write(self.path, content)
+
+
+def ref_prefixes(reference, guess=True):
+    """ Returns the ref prefixes to list to resolve a reference
+    with find_latest_remote_ref: the branch, its EOL tag,
+    and the tags of its series if guess work is allowed.
+    """
+    prefixes = ['refs/heads/' + reference]
+    if reference.startswith('stable/'):
+        prefixes.append('refs/tags/{}-eol'.format(reference[len('stable/'):]))
+    series, _, _ = reference.rpartition('.')
+    if guess and series:
+        prefixes.append('refs/tags/{}.'.format(series))
+    return prefixes
+
+
+def ref_cache_key(url, prefixes=None):
+    """ Returns the RefCache key of a (filtered) listing """
+    if not prefixes:
+        return url
+    return "{} {}".format(url, " ".join(sorted(set(prefixes))))
+
+
+def pkt_line(data=None):
+    """ Encodes a git pkt-line, or a flush packet """
+    if data is None:
+        return b'0000'
+    data = data.encode('utf-8')
+    return '{:04x}'.format(len(data) + 4).encode('ascii') + data
+
+
+def iter_pkt_lines(stream):
+    """ Yields the payloads of the pkt-lines read from
+    a file-like stream, until a flush packet.
+    """
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            raise ValueError("Truncated pkt-line")
+        length = int(header, 16)
+        if length == 0:
+            return
+        if length < 4:
+            # delimiter or response end packets
+            continue
+        yield stream.read(length - 4).decode('utf-8').rstrip('\n')
+
+
+def ls_refs_request(prefixes):
+    """ Returns a protocol v2 ls-refs request for ref prefixes """
+    return b''.join([pkt_line('command=ls-refs\n'), b'0001'] +
+                    [pkt_line('ref-prefix {}\n'.format(prefix))
+                     for prefix in prefixes] + [pkt_line()])
+
+
+def iter_ls_refs(stream):
+    """ Yields the ls-refs response of a stream as
+    ls-remote lines (sha, tab, ref name).
+    """
+    for line in iter_pkt_lines(stream):
+        sha, name = line.split(' ')[:2]
+        yield "{}\t{}".format(sha, name)
+
+
+def local_ls_refs(path, prefixes, timeout=None):
+    """ Returns the refs of a local repo starting with prefixes,
+    asked to git upload-pack with protocol v2. Returns None if
+    git does not speak protocol v2 (before git 2.18).
+    """
+    command = ['git', 'upload-pack', '--stateless-rpc', path]
+    env = dict(os.environ, GIT_PROTOCOL='version=2')
+    process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env)
+    timer = threading.Timer(timeout, process.kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        process.stdin.write(ls_refs_request(prefixes))
+        process.stdin.close()
+        try:
+            refs = list(iter_ls_refs(process.stdout))
+        except ValueError:
+            refs = None
+        stderr = process.stderr.read()
+        status = process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+    if status < 0:
+        # Killed after timeout
+        raise gitExceptions.GitCommandError(command, status, stderr)
+    if status or refs is None:
+        return None
+    return refs
+
+
+def http_ls_refs(url, prefixes, timeout=None):
+    """ Returns the refs of a smart HTTP remote starting with
+    prefixes, asked with protocol v2. Returns None if the
+    server does not speak protocol v2.
+    """
+    headers = {
+        'Git-Protocol': 'version=2',
+        'Content-Type': 'application/x-git-upload-pack-request',
+        'Accept': 'application/x-git-upload-pack-result',
+    }
+    try:
+        response = requests.post('{}/git-upload-pack'.format(url.rstrip('/')),
+                                 data=ls_refs_request(prefixes),
+                                 headers=headers, timeout=timeout,
+                                 stream=True)
+    except requests.RequestException:
+        return None
+    try:
+        if (response.status_code != 200 or
+                response.headers.get('Content-Type') !=
+                'application/x-git-upload-pack-result'):
+            return None
+        response.raw.decode_content = True
+        return list(iter_ls_refs(response.raw))
+    except ValueError:
+        return None
+    finally:
+        response.close()
+
+
+def ls_remote(url, prefixes=None, timeout=None):
+    """ Returns the lines of git ls-remote for the branches and tags
+    of a remote url, parsed while git is running.
+    Only the refs starting with prefixes are listed, if given.
     """
     # Use GitPtyhon git.cmd to avoid fetching repos
     # as listing remotes is not implemented outside Repo use
     gcli = gitcmd.Git()
+    args = ['--refs', url]
+    if prefixes:
+        args[:0] = ['--heads', '--tags']
+        args.extend(prefix + '*' if prefix.endswith('.') else prefix
+                    for prefix in prefixes)
+    process = gcli.ls_remote(*args, as_process=True)
+    timer = threading.Timer(timeout, process.proc.kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        refs = [line.decode('utf-8').rstrip('\n')
+                for line in iter(process.stdout.readline, b'')]
+        process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+    return refs
+
+
+def list_remote_refs(url, ref_cache=None, timeout=None, prefixes=None):
+    """ Returns the lines of git ls-remote for a remote url.
+    If prefixes (like refs/heads/stable/pike or refs/tags/16.0.)
+    are given, only the matching refs are asked to the remote,
+    with protocol v2 when possible, which is much lighter than
+    a full listing for remotes with many tags.
+    Uses ref_cache (a RefCache) if given.
+    The ls-remote is killed after timeout seconds, if given.
+    """
+    key = ref_cache_key(url, prefixes)
+    if ref_cache is not None:
+        refs = ref_cache.get(key)
+        if refs is not None:
+            return refs
+    with trace_span('git', 'ls-remote', url=url):
+        refs = None
+        if prefixes:
+            parsed_url = urlparse(url)
+            if parsed_url.scheme in ('', 'file') and \
+                    os.path.isdir(parsed_url.path):
+                refs = local_ls_refs(parsed_url.path, prefixes, timeout)
+            elif parsed_url.scheme in ('http', 'https'):
+                refs = http_ls_refs(url, prefixes, timeout)
+        if refs is None:
+            refs = ls_remote(url, prefixes, timeout)
+    if ref_cache is not None:
+        ref_cache.set(key, refs)
+    return refs
+
+
+def patch_key(patch):
+    """ Returns a sort key of the last part of a version,
+    comparing numbers numerically, and pre-releases
+    before the release: 9 < 10rc1 < 10 < 11.
+    """
+    match = re.match(r'(\d*)(.*)$', patch)
+    number, suffix = match.groups()
+    return (int(number) if number else -1, 0 if suffix else 1,
+            tuple((0, int(part), '') if part.isdigit() else (1, 0, part)
+                  for part in re.findall(r'\d+|\D+', suffix)))
+
+
+class RefIndex(object):
+    """ Index of the branches and tags of a remote listing
+    (see list_remote_refs), built once to answer the
+    lookups of find_latest_remote_ref in constant time.
+    Tags are grouped by series (their version without its
+    last part) and only the latest patch of each series is
+    kept, with numeric comparisons (see patch_key).
+    """
     # this stores a sha for a matching branch/tag
     # tag will watch if ending with a number
     # (so v11.1, 1.11.1rc1 would still match)
-    regex = re.compile('(?P<sha>[0-9a-f]{40})\t(?P<fullref>'
-                       'refs/heads/(?P<branch>.*)'
-                       '|refs/tags/(?P<tag>.*(\d|-eol)))')
+    REF_REGEX = re.compile('(?P<sha>[0-9a-f]{40})\t(?P<fullref>'
+                           'refs/heads/(?P<branch>.*)'
+                           '|refs/tags/(?P<tag>.*(\\d|-eol)))')
 
-    # search_ver will become ["master"], ["eol-mitaka"],
-    # ["stable/pike"], ["16", "1", "9"]
-    search_ver = reference.split('.')
+    def __init__(self, refs):
+        self.branches = {}
+        self.tags = {}
+        self.eol_tags = set()
+        # series -> (patch_key, patch) of its latest patch
+        self.series = {}
+        for line in refs:
+            match = self.REF_REGEX.match(line)
+            if not match:
+                continue
+            branch, tag = match.group('branch'), match.group('tag')
+            if branch is not None:
+                self.branches.setdefault(branch, match.group('sha'))
+                continue
+            self.tags.setdefault(tag, match.group('sha'))
+            if tag.endswith('-eol'):
+                self.eol_tags.add(tag)
+            series, _, patch = tag.rpartition('.')
+            if series:
+                key = patch_key(patch)
+                if series not in self.series or key > self.series[series][0]:
+                    self.series[series] = (key, patch)
 
-    # For EOL tag matching
-    if 'stable/' in reference:
-        eol_tag = reference.strip('stable/') + '-eol'
-    else:
-        eol_tag = None
-
-    # sadly we can't presume the ls-remote list will be sorted
-    # so we have to find out ourselves.
-    patch_releases = []
-
-    for remote in gcli.ls_remote('--refs', url).splitlines():
-        m = regex.match(remote)
-        # First, start to match the remote result with a branchname
-        if m and m.group('branch') and m.group('branch') == reference:
-            return m.group('sha')
-        # Try to match EOL tag
-        elif eol_tag and m and m.group('tag') == eol_tag:
-            return eol_tag
-        # Then try to find closest matching tags if guess work is allowed
-        elif m and m.group('tag') and guess:
-            ref_of_tag = m.group('tag').split('.')
-            # keep a tag if it's almost the same (only last part changes)
-            # as what we are looking for.
-            # Store its reference and sha.
-            if ref_of_tag[0:-1] and ref_of_tag[0:-1] == search_ver[0:-1]:
-                # store only the last bit, space efficient!
-                patch_releases.append(ref_of_tag[-1])
-
-    # Returns the highest value if something was found
-    if patch_releases:
-        search_ver[-1] = max(patch_releases)
-        return ".".join(search_ver)
+    def branch_head(self, branch):
+        """ Returns the sha of a branch, or None """
+        return self.branches.get(branch)
+
+    def eol_tag(self, branch):
+        """ Returns the EOL tag of a stable branch (stable/pike
+        is tagged pike-eol), or None.
+        """
+        if not branch.startswith('stable/'):
+            return None
+        tag = branch[len('stable/'):] + '-eol'
+        return tag if tag in self.eol_tags else None
+
+    def latest_patch(self, version):
+        """ Returns the latest tag of the series of version
+        (16.0.9 -> 16.0.12), or None.
+        """
+        series, _, _ = version.rpartition('.')
+        if not series or series not in self.series:
+            return None
+        return "{}.{}".format(series, self.series[series][1])
+
+
+def remote_ref_index(url, ref_cache=None, timeout=None, prefixes=None):
+    """ Returns the RefIndex of a remote (restricted to
+    prefixes, if given), from ref_cache if given
+    (see list_remote_refs).
+    """
+    if ref_cache is None:
+        return RefIndex(list_remote_refs(url, timeout=timeout,
+                                         prefixes=prefixes))
+    key = ref_cache_key(url, prefixes)
+    index = ref_cache.index(key)
+    if index is None:
+        # The listing may be evicted by other threads before
+        # it is read again: index the returned one
+        refs = list_remote_refs(url, ref_cache, timeout, prefixes)
+        index = RefIndex(refs)
+        ref_cache.set_index(key, refs, index)
+    return index
+
+
+def find_latest_remote_ref(url, reference, guess=True, ref_cache=None,
+                           prefixes=None):
+    """ Discovers, from a git remote, the latest
+        "appropriate" tag/sha based on a reference:
+        If reference is a branch, returns the sha
+        for the head of the branch.
+        If reference is a stable branch which reached its
+        end of life, returns its EOL tag.
+        If reference is a tag, find the latest patch
+        release of the same tag line.
+        Only the refs needed for reference are listed (see
+        ref_prefixes), unless other prefixes are given.
+        Remote listings are read from ref_cache if given.
+    """
+    if prefixes is None:
+        prefixes = ref_prefixes(reference, guess)
+    index = remote_ref_index(url, ref_cache, prefixes=prefixes)
+    return index_latest_ref(index, reference, guess)
+
+
+def index_latest_ref(index, reference, guess=True):
+    """ Returns the latest ref of reference in a RefIndex
+    (see find_latest_remote_ref).
+    """
+    sha = index.branch_head(reference)
+    if sha:
+        return sha
+    eol_tag = index.eol_tag(reference)
+    if eol_tag:
+        return eol_tag
+    if guess:
+        latest = index.latest_patch(reference)
+        if latest:
+            return latest
     # Nothing else found: Return original reference.
     return reference
 
 
+def resolve_remote_refs(queries, jobs=REF_JOBS, timeout=REF_TIMEOUT,
+                        retries=REF_RETRIES, guess=True, ref_cache=None):
+    """ Resolves many (url, reference) pairs with find_latest_remote_ref,
+    listing each remote only once, in a pool of jobs threads.
+    Each listing is killed after timeout seconds and retried
+    retries times.
+    Returns a tuple (resolved, timings, errors) where
+    resolved maps (url, reference) to the resolved ref,
+    timings maps each url to the seconds spent listing it,
+    and errors maps each url that could not be listed to its error.
+    """
+    if ref_cache is None:
+        ref_cache = RefCache()
+    references = OrderedDict()
+    for url, reference in queries:
+        references.setdefault(url, [])
+        if reference not in references[url]:
+            references[url].append(reference)
+
+    def resolve(url):
+        """ Lists the refs of a remote needed by all its
+        references at once, and resolves them.
+        """
+        start = time.time()
+        prefixes = sorted(set(prefix for reference in references[url]
+                              for prefix in ref_prefixes(reference, guess)))
+        for attempt in range(retries + 1):
+            try:
+                index = remote_ref_index(url, ref_cache, timeout, prefixes)
+            except gitExceptions.GitCommandError as gce_except:
+                if attempt == retries:
+                    return url, None, time.time() - start, gce_except
+            else:
+                break
+        results = dict(((url, reference),
+                        index_latest_ref(index, reference, guess))
+                       for reference in references[url])
+        return url, results, time.time() - start, None
+
+    resolved = {}
+    timings = {}
+    errors = {}
+    pool = ThreadPool(max(1, min(jobs, len(references) or 1)))
+    try:
+        for url, results, duration, error in pool.imap_unordered(
+                resolve, references):
+            timings[url] = duration
+            if error is not None:
+                errors[url] = error
+            else:
+                resolved.update(results)
+    finally:
+        pool.close()
+        pool.join()
+    return resolved, timings, errors
+
+
+def mirror_path(url, mirror_dir=MIRROR_DIR):
+    """ Returns the path of the bare mirror of a remote url """
+    name = re.sub('[^A-Za-z0-9._-]+', '_', re.sub('^[a-z+]+://', '', url))
+    if not name.endswith('.git'):
+        name += '.git'
+    return os.path.join(mirror_dir, name)
+
+
+def update_mirror(url, mirror_dir=MIRROR_DIR):
+    """ Creates the bare mirror of the branches and tags of
+    a remote url, or fetches the new commits if it exists.
+    Returns the mirror path.
+    """
+    path = mirror_path(url, mirror_dir)
+    with MIRROR_LOCKS_LOCK:
+        lock = MIRROR_LOCKS.setdefault(path, threading.Lock())
+    with lock:
+        if os.path.isdir(path):
+            with trace_span('git', 'fetch mirror', url=url):
+                Repo(path).git.fetch('--prune', 'origin', *MIRROR_REFSPECS)
+        else:
+            if not os.path.isdir(mirror_dir):
+                os.makedirs(mirror_dir)
+            with trace_span('git', 'clone mirror', url=url):
+                mirror = Repo.init(path, bare=True)
+                mirror.git.config('remote.origin.url', url)
+                for refspec in MIRROR_REFSPECS:
+                    mirror.git.config('--add', 'remote.origin.fetch', refspec)
+                mirror.git.fetch('origin')
+    return path
+
+
+def fetch_repo(url, path, branch, mode='full', sparse_paths=None,
+               mirror_dir=None, checkout=True):
+    """ Clones a repo at a given branch, returns the Repo.
+    mode is one of FETCH_MODES. Shallow and blobless clones
+    only fetch the given branch, and only check out the
+    sparse_paths (list of folders) if given.
+    If mirror_dir is given, the objects are taken from
+    the shared mirror of the url (see update_mirror) instead
+    of being downloaded again.
+    If checkout is False, the working tree stays empty.
+    """
+    options = {}
+    if mirror_dir:
+        options['reference'] = update_mirror(url, mirror_dir)
+    if not checkout:
+        options['no_checkout'] = True
+    elif mode != 'full':
+        options['single_branch'] = True
+        options['no_checkout'] = bool(sparse_paths)
+    if mode == 'shallow':
+        options['depth'] = 1
+    elif mode == 'blobless':
+        options['filter'] = 'blob:none'
+    with trace_span('git', 'clone', url=url, mode=mode):
+        repo = Repo.clone_from(url=url, to_path=path, branch=branch,
+                               **options)
+    if checkout and mode != 'full' and sparse_paths:
+        repo.git.config('core.sparseCheckout', 'true')
+        info_dir = os.path.join(repo.git_dir, 'info')
+        if not os.path.isdir(info_dir):
+            os.makedirs(info_dir)
+        with open(os.path.join(info_dir, 'sparse-checkout'), 'w') as sp_fh:
+            sp_fh.write("\n".join(sparse_paths) + "\n")
+        with trace_span('git', 'sparse checkout', url=url):
+            repo.git.read_tree('-mu', 'HEAD')
+    return repo
+
+
+def missing_alternates(repo):
+    """ Returns the object folders a Repo borrows objects from
+    (see fetch_repo) which do not exist anymore
+    """
+    objects_dir = os.path.join(repo.git_dir, 'objects')
+    alternates = os.path.join(objects_dir, 'info', 'alternates')
+    if not os.path.exists(alternates):
+        return []
+    with open(alternates) as alt_fh:
+        folders = [os.path.join(objects_dir, line.strip())
+                   for line in alt_fh
+                   if line.strip() and not line.startswith('#')]
+    return [folder for folder in folders if not os.path.isdir(folder)]
+
+
+def reuse_repo(url, path, mirror_dir=None):
+    """ Returns the existing clone of url at path, once the mirror
+    it borrows objects from is up to date, or None if there is no
+    clone. A deleted mirror is created again; if the clone still
+    misses the objects it borrowed, it is deleted.
+    """
+    if not os.path.lexists(path):
+        return None
+    repo = Repo(path)
+    alternates = os.path.join(repo.git_dir, 'objects', 'info', 'alternates')
+    if mirror_dir and os.path.exists(alternates):
+        # Download new objects only once, in the mirror
+        update_mirror(url, mirror_dir)
+    if missing_alternates(repo):
+        shutil.rmtree(path)
+        return None
+    return repo
+
+
+def sync_repo(url, path, branch, mirror_dir=None, checkout=True):
+    """ Clones a repo at a given branch (see fetch_repo),
+    or pulls it if it already exists. Returns the Repo.
+    If checkout is False, new clones have no working tree,
+    and existing clones are only fetched.
+    """
+    repo = reuse_repo(url, path, mirror_dir)
+    if repo is None:
+        return fetch_repo(url, path, branch, mirror_dir=mirror_dir,
+                          checkout=checkout)
+    if checkout:
+        with trace_span('git', 'pull', url=url):
+            repo.remotes.origin.pull()
+    else:
+        with trace_span('git', 'fetch', url=url):
+            repo.remotes.origin.fetch()
+    return repo
+
+
+def reset_repo(url, path, branch, mode='full', mirror_dir=None):
+    """ Clones a repo at a given branch (see fetch_repo), or
+    fetches it if it already exists and resets it to the remote
+    branch, discarding its local changes. Returns the Repo.
+    Shallow clones stay shallow.
+    """
+    repo = reuse_repo(url, path, mirror_dir)
+    if repo is None:
+        return fetch_repo(url, path, branch, mode=mode, mirror_dir=mirror_dir)
+    options = {}
+    if os.path.exists(os.path.join(repo.git_dir, 'shallow')):
+        options['depth'] = 1
+    with trace_span('git', 'fetch', url=url):
+        repo.git.fetch('origin', '+refs/heads/{0}:refs/remotes/origin/{0}'
+                       .format(branch), **options)
+    with trace_span('git', 'reset', url=url):
+        repo.git.checkout('-f', '-B', branch, 'origin/' + branch)
+        repo.git.clean('-f', '-d')
+    return repo
+
+
+def has_local_changes(repo, branch, remote='origin'):
+    """ Returns whether a Repo has uncommitted changes, untracked
+    files or commits which are not on the remote branch.
+    """
+    try:
+        if repo.is_dirty(untracked_files=True):
+            return True
+        return bool(repo.git.rev_list('{}/{}..HEAD'.format(remote, branch)))
+    except gitExceptions.GitCommandError:
+        return True
+
+
+class ObjectReader(object):
+    """ Reads files from the git objects of many repos,
+    without checking them out.
+    The objects of all the repos are made available to a
+    single bare repo at path, through alternates, so that
+    all the files are read by a single long-lived
+    git cat-file --batch process.
+    """
+
+    def __init__(self, path, repos):
+        if os.path.isdir(path):
+            self.repo = Repo(path)
+        else:
+            self.repo = Repo.init(path, bare=True)
+        info_dir = os.path.join(self.repo.git_dir, 'objects', 'info')
+        if not os.path.isdir(info_dir):
+            os.makedirs(info_dir)
+        # Alternates have to be known before cat-file starts
+        with open(os.path.join(info_dir, 'alternates'), 'w') as alt_fh:
+            for repo in repos:
+                alt_fh.write(os.path.join(repo.git_dir, 'objects') + "\n")
+
+    @staticmethod
+    def resolve(repo, branch, remote='origin'):
+        """ Returns the sha of a remote branch of a repo,
+        or None if the branch does not exist.
+        Refs are read from disk, without running git.
+        """
+        try:
+            return SymbolicReference.dereference_recursive(
+                repo, 'refs/remotes/{}/{}'.format(remote, branch))
+        except ValueError:
+            return None
+
+    def read(self, sha, path):
+        """ Returns the content of a file at a given commit sha,
+        or None if the file does not exist.
+        """
+        blob = self.read_blob(sha, path)
+        if blob is None:
+            return None
+        return blob[3]
+
+    def read_blob(self, sha, path):
+        """ Returns (blob sha, type, size, content) of a file at
+        a given commit sha, or None if the file does not exist.
+        """
+        try:
+            with trace_span('git', 'cat-file', path=path):
+                return self.repo.git.get_object_data(
+                    '{}:{}'.format(sha, path))
+        except ValueError:
+            return None
+
+    def read_yaml(self, sha, path):
+        """ Returns the data of a YAML file at a given commit sha,
+        cached by blob sha (see parse_yaml), or None if the file
+        does not exist.
+        """
+        blob = self.read_blob(sha, path)
+        if blob is None:
+            return None
+        return parse_yaml(blob[3], key=blob[0])
+
+
+def git_objects_size(repo):
+    """ Returns the size in bytes of the objects of a Repo,
+    which is roughly what was transferred when cloning it.
+    Objects borrowed from a mirror are not counted, see
+    mirror_objects_size.
+    """
+    return objects_size(repo.git_dir)
+
+
+def mirror_objects_size(url, mirror_dir=MIRROR_DIR):
+    """ Returns the size in bytes of the objects of the mirror
+    of a remote url, 0 if it is not mirrored yet.
+    """
+    return objects_size(mirror_path(url, mirror_dir))
+
+
+def objects_size(git_dir):
+    """ Returns the size in bytes of the objects of a git folder """
+    size = 0
+    objects_dir = os.path.join(git_dir, 'objects')
+    for root, _, files in os.walk(objects_dir):
+        for filename in files:
+            size += os.path.getsize(os.path.join(root, filename))
+    return size
+
+
+class RoleRequirement(object):
+    """ A role of ansible-role-requirements.yml.
+    Its version is read from and written to the YAML
+    mapping it was loaded from (data).
+    """
+    __slots__ = ('data', 'name', 'src', 'scm', 'host', 'openstack_hosted')
+
+    def __init__(self, data):
+        self.data = data
+        self.name = data['name']
+        self.src = data.get('src', '')
+        self.scm = data.get('scm')
+        self.host = urlparse(self.src).netloc
+        self.openstack_hosted = self.src.startswith(OPENSTACK_REPOS + '/')
+
+    @property
+    def version(self):
+        """ Version (branch, tag or sha) of the role """
+        return self.data.get('version')
+
+    @version.setter
+    def version(self, version):
+        self.data['version'] = version
+
+
+class RoleRequirements(object):
+    """ The roles of an ansible-role-requirements.yml file,
+    indexed by name, source host and OpenStack hosting.
+    Use load() to write the file back with its original
+    indentation, or read() if it is only read.
+    """
+    __slots__ = ('data', 'indent', 'block_seq_indent', 'roles',
+                 'by_name', 'by_host', 'openstack_roles', 'external_roles')
+
+    def __init__(self, data, indent=None, block_seq_indent=None):
+        self.data = data
+        self.indent = indent
+        self.block_seq_indent = block_seq_indent
+        self.roles = [RoleRequirement(role_data) for role_data in data]
+        self.by_name = dict((role.name, role) for role in self.roles)
+        self.by_host = {}
+        self.openstack_roles = []
+        self.external_roles = []
+        for role in self.roles:
+            self.by_host.setdefault(role.host, []).append(role)
+            if role.openstack_hosted:
+                self.openstack_roles.append(role)
+            else:
+                self.external_roles.append(role)
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a file, keeping its formatting (see load_yaml) """
+        data, ind, bsi = load_yaml(path)
+        return cls(data, ind, bsi)
+
+    @classmethod
+    def read(cls, path):
+        """ Reads a file which will not be written back
+        (see read_yaml)
+        """
+        return cls(read_yaml(path))
+
+    def __iter__(self):
+        return iter(self.roles)
+
+    def __len__(self):
+        return len(self.roles)
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def get(self, name, default=None):
+        """ Returns the role with the given name """
+        return self.by_name.get(name, default)
+
+    def dump(self, path):
+        """ Writes the roles to path, with the indentation
+        of the loaded file.
+        """
+        with trace_span('yaml', 'dump', path=path):
+            with open(path, 'w') as role_req_file:
+                yaml = YAML()
+                yaml.default_flow_style = False
+                yaml.block_seq_indent = self.block_seq_indent
+                yaml.indent = self.indent
+                yaml.dump(self.data, role_req_file)
+
+
 def tracking_branch_name(git_folder):
     """ Returns the branch name of the repo
     you are currently tracking.
@@ -137,20 +1303,28 @@ def tracking_branch_name(git_folder):
     return "{}".format(tracking_branch.remote_head)
 
 
-def bump_project_sha_with_comments(match, previous_line):
+def bump_project_sha_with_comments(match, previous_line, ref_cache=None,
+                                   resolved=None):
     """ Take a line like:
     requirements_git_install_branch: 0143d0c2c9fc67380a4ae8e505a9a3fb55c0e888 # HEAD of "stable/pike" as of 11.09.2017
     and updates the sha, and the date, based on the branch found in the line.
     The information from previous_line contains the remote and its project (to validate data)
+    The sha is taken from resolved, a dict of (remote, branch) -> sha
+    (see resolve_remote_refs), if already known.
     """
     # Ensure previously saved line is the same as current line before
     # patching
     if previous_line['project'] != match.group('project'):
         raise SystemExit
+    query = (previous_line['remote'], match.group('branch'))
+    if resolved and query in resolved:
+        sha = resolved[query]
+    else:
+        sha = find_latest_remote_ref(*query, ref_cache=ref_cache)
     data = {
         "project": previous_line['project'],
         "branch": match.group('branch'),
-        "sha": find_latest_remote_ref(previous_line['remote'], match.group('branch')),
+        "sha": sha,
         "date": '{:%d.%m.%Y}'.format(datetime.now())
     }
     return ('{project}_git_install_branch: '